@@ -20,9 +20,6 @@
 import getopt
 import os
 import sys
-import tkinter as tk
-
-from app import PyditorApplication
 
 # Owned
 __author__ = "3ricsonn"
@@ -37,6 +34,30 @@ __status__ = "DEV"
 # CONSTANTS
 DIRNAME: str = os.path.dirname(__file__)
 file_path: str = ""
+backend: str = "serial"
+metrics: bool = False
+open_mode: str = "file"
+
+USAGE: str = """
+Usage: pyditor [OPTIONS] [-f file-path]
+       pyditor batch OPERATION [PAGES] [-o PATH] [-j NUMBER] [FILE... | -]
+
+Options:
+    General Options
+        -h, --help          Shows this help text and exit
+        --version           Print program version and exit
+        --copyright         Print copyright information
+    File editing
+        -f  PATH            Start the editor with the given document path
+        --open MODE         Open documents from the "file", "mmap"ed or in "memory"
+    Rendering
+        --backend NAME      Render pages "serial", on "thread"s or on "process"es
+    Debugging
+        --metrics           Record timings and counters shown in the debug menu
+    Batch mode
+        batch               Reorder, extract, delete or merge pages of many
+                            files without a window, see: pyditor batch
+"""
 
 
 def print_sash_pos():
@@ -45,91 +66,164 @@ def print_sash_pos():
     print(f"2.: {app.bodyPanel.sash_coord(1)}")
 
 
-# handling command line commands
-try:
-    opts, _ = getopt.getopt(
-        sys.argv[1:], shortopts="f:", longopts=["version", "copyright"]
-    )
-except getopt.GetoptError:
-    print(
-        """
-    Invalid argument(s)
-    For usage information run: pyditor -h | --help
-    For version information run: pyditor --version
-    """
+def print_cache_stats():
+    """Print usage of the render cache for debugging"""
+    cache = app.renderCache
+    print(f"images: {len(cache)}, size: {cache.size / 1024 ** 2:.1f} MiB")
+    print(f"hits: {cache.hits}, misses: {cache.misses}, rate: {cache.hit_rate:.1%}")
+    if app.thumbnailStore is not None:
+        store = app.thumbnailStore
+        print(f"thumbnails on disk: {store.size / 1024 ** 2:.1f} MiB", end=", ")
+        print(f"hits: {store.hits}, misses: {store.misses}")
+
+
+def print_document_stats():
+    """Print how the document was loaded and the memory of the process for debugging"""
+    loaded = app.loadedDocument
+    if loaded is not None:
+        print(f"{loaded.path} ({loaded.mode})", end=", ")
+        print(f"loaded in {loaded.load_time * 1000:.1f} ms", end=", ")
+        print(f"resident memory added: {loaded.memory / 1024 ** 2:.1f} MiB")
+    print(f"resident memory: {resident_memory() / 1024 ** 2:.1f} MiB")
+
+
+def print_metrics():
+    """Print timings and counters of the hot paths for debugging"""
+    print(METRICS.report())
+
+
+def save_metrics():
+    """Save the metrics as JSON or as trace events to a chosen file"""
+    path = asksaveasfilename(
+        title="Save metrics as:",
+        defaultextension=".json",
+        filetypes=[("Metrics", "*.json"), ("Trace events", "*.trace.json")],
     )
-    sys.exit()
+    if path.endswith(".trace.json"):
+        METRICS.dump_trace(path)
+    elif path:
+        METRICS.dump(path)
+
+
+if __name__ == "__main__":
+    # page operations without a window, so tkinter is not even imported
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        import batch
 
-for opt, arg in opts:
-    if opt in ("-h", "--help"):
+        sys.exit(batch.main(sys.argv[2:]))
+
+    import tkinter as tk
+    from tkinter.filedialog import asksaveasfilename
+
+    from app import PyditorApplication
+    from document import OPEN_MODES, resident_memory
+    from metrics import METRICS
+    from rendering import BACKENDS
+
+    # handling command line commands
+    try:
+        opts, _ = getopt.getopt(
+            sys.argv[1:],
+            shortopts="f:",
+            longopts=["version", "copyright", "backend=", "metrics", "open="],
+        )
+    except getopt.GetoptError:
         print(
             """
-            Usage: pyditor [OPTIONS] [-f file-path]
-
-            Options:
-                General Options
-                    -h, --help          Shows this help text and exit
-                    --version           Print program version and exit
-                    --copyright         Print copyright information
-                File editing
-                    -f  PATH            Start the editor with the given document path
-            """
+        Invalid argument(s)
+        For usage information run: pyditor -h | --help
+        For version information run: pyditor --version
+        """
         )
         sys.exit()
 
-    elif opt == "-f":
-        file_path = os.path.join(DIRNAME, arg.strip())
-    elif opt == "--version":
-        print(f"Current version: {__version__}, status: {__status__}")
-        sys.exit()
-    elif opt == "--copyright":
-        print(
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(USAGE)
+            sys.exit()
+
+        elif opt == "-f":
+            file_path = os.path.join(DIRNAME, arg.strip())
+        elif opt == "--backend":
+            backend = arg.strip()
+            if backend not in BACKENDS:
+                print(f"Unknown render backend: {backend}\n{USAGE}")
+                sys.exit(2)
+        elif opt == "--metrics":
+            metrics = True
+        elif opt == "--open":
+            open_mode = arg.strip()
+            if open_mode not in OPEN_MODES:
+                print(f"Unknown open mode: {open_mode}\n{USAGE}")
+                sys.exit(2)
+        elif opt == "--version":
+            print(f"Current version: {__version__}, status: {__status__}")
+            sys.exit()
+        elif opt == "--copyright":
+            print(
+                """
+            pyditor  Copyright (C) 2021  3ricsonn
+            This program comes with ABSOLUTELY NO WARRANTY.
+            This is free software, and you are welcome to redistribute it
+            under certain conditions; for details please refer to LICENSE.
             """
-        pyditor  Copyright (C) 2021  3ricsonn
-        This program comes with ABSOLUTELY NO WARRANTY.
-        This is free software, and you are welcome to redistribute it
-        under certain conditions; for details please refer to LICENSE.
-        """
+            )
+            sys.exit()
+
+    # create the window and do basic configuration
+    rootWindow = tk.Tk()
+    rootWindow.title("Pyditor - edit PDFs")
+    rootWindow.geometry("1350x1300")
+
+    # creating and packing the Main Application
+    with PyditorApplication(
+        rootWindow, backend=backend, metrics=metrics, open_mode=open_mode
+    ) as app:
+
+        # open file via commandline
+        if file_path != "":
+            app.set_document(doc=file_path)
+
+        # == creating menus ==
+        # the main menu
+        mainMenu = tk.Menu(master=rootWindow)
+        rootWindow.config(menu=mainMenu)
+
+        # creating menu taps
+        # -- file-menu --
+        fileMenu = tk.Menu(master=mainMenu, tearoff=False)
+        mainMenu.add_cascade(label="File", menu=fileMenu)
+        fileMenu.add_command(label="Open", command=app.open_file)
+        fileMenu.add_command(label="Add source...", command=app.add_source)
+        fileMenu.add_command(label="Save", command=app.save_file)
+        fileMenu.add_command(label="Save as...", command=app.save_file_name)
+        fileMenu.add_separator()
+        fileMenu.add_command(label="Exit", command=rootWindow.quit)
+
+        # -- edit-menu --
+        editMenu = tk.Menu(master=mainMenu, tearoff=False)
+        mainMenu.add_cascade(label="Edit", menu=editMenu)
+        editMenu.add_command(label="Undo", accelerator="Ctrl+Z", command=app.undo)
+        editMenu.add_command(label="Redo", accelerator="Ctrl+Y", command=app.redo)
+        rootWindow.bind("<Control-z>", lambda _: app.undo())
+        rootWindow.bind("<Control-y>", lambda _: app.redo())
+
+        # debugging
+        debug = tk.Menu(master=rootWindow, tearoff=False)
+        mainMenu.add_cascade(label="debug", menu=debug)
+        debug.add_command(label="sash", command=print_sash_pos)
+        debug.add_command(label="cache", command=print_cache_stats)
+        debug.add_command(label="document", command=print_document_stats)
+        debug.add_separator()
+        recordMetrics = tk.BooleanVar(value=METRICS.enabled)
+        debug.add_checkbutton(
+            label="record metrics",
+            variable=recordMetrics,
+            command=lambda: setattr(METRICS, "enabled", recordMetrics.get()),
         )
-        sys.exit()
+        debug.add_command(label="metrics", command=print_metrics)
+        debug.add_command(label="save metrics...", command=save_metrics)
+        debug.add_command(label="reset metrics", command=METRICS.reset)
 
-# create the window and do basic configuration
-rootWindow = tk.Tk()
-rootWindow.title("Pyditor - edit PDFs")
-rootWindow.geometry("1350x1300")
-
-# creating and packing the Main Application
-with PyditorApplication(rootWindow) as app:
-
-    # open file via commandline
-    if file_path != "":
-        app.set_document(doc=file_path)
-
-    # == creating menus ==
-    # the main menu
-    mainMenu = tk.Menu(master=rootWindow)
-    rootWindow.config(menu=mainMenu)
-
-    # creating menu taps
-    # -- file-menu --
-    fileMenu = tk.Menu(master=mainMenu, tearoff=False)
-    mainMenu.add_cascade(label="File", menu=fileMenu)
-    fileMenu.add_command(label="Open", command=app.open_file)
-    fileMenu.add_command(label="Save", command=app.save_file)
-    fileMenu.add_command(label="Save as...", command=app.save_file_name)
-    fileMenu.add_separator()
-    fileMenu.add_command(label="Exit", command=rootWindow.quit)
-
-    # -- edit-menu --
-    editMenu = tk.Menu(master=mainMenu, tearoff=False)
-    mainMenu.add_cascade(label="Edit", menu=editMenu)
-    editMenu.add_command(label="Undo")
-    editMenu.add_command(label="Redo")
-
-    # debugging
-    debug = tk.Menu(master=rootWindow, tearoff=False)
-    mainMenu.add_cascade(label="debug", menu=debug)
-    debug.add_command(label="sash", command=print_sash_pos)
-
-    # run the windows mainloop
-    rootWindow.mainloop()
+        # run the windows mainloop
+        rootWindow.mainloop()
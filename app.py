@@ -1,70 +1,156 @@
+import os
 import sys
 import tkinter as tk
+import weakref
 from tkinter import ttk
-from tkinter.filedialog import askopenfilename
-from typing import Dict, List, Any, Callable, Collection
+from tkinter import messagebox
+from tkinter.filedialog import askopenfilename, asksaveasfilename
+from typing import Dict, Any, Callable, Optional, Tuple
 
 import fitz  # PyMuPDF
 
-from components import SidePageViewer, PagesEditor, SideSelectionViewer
-from widgets import CollapsibleFrame
+from components import (
+    SidePageViewer,
+    PagesEditor,
+    SideSelectionViewer,
+    SourceViewer,
+    SearchBar,
+)
+from document import LoadedDocument, OpenJob, SaveJob, resident_memory
+from history import Command, History
+from metrics import METRICS
+from pagemodel import PageModel
+from rendering import MUPDF_LOCK, RenderCache, make_backend
+from search import Indexer
+from thumbnails import ThumbnailStore
+from widgets import CollapsibleFrame, ProgressDialog
+from workspace import Workspace
 
 __all__ = ["PyditorApplication"]
 
 
 class EventHandler:
-    """Centralised event-handler for communication between the components"""
-
-    __functions: Dict[str, List[Callable]] = {}
-    __values: Dict[str, List[Collection[Any]]] = {}
+    """Centralised event-handler for communication between the components
+
+    Every handler keeps its own registry. Bound methods are held by weak
+    reference, so destroyed widgets drop out of the registry instead of being
+    kept alive by it. Events posted with post are deferred to the next idle
+    cycle of the event loop and repeated posts of a hook are merged into one
+    dispatch with the latest arguments.
+    """
+
+    def __init__(self, schedule: Optional[Callable[[Callable], Any]] = None):
+        # references to the functions of each hook, replaced as a whole on change
+        self.__functions: Dict[str, Tuple[Callable, ...]] = {}
+        # stored arguments and the value handed out by get_values
+        self.__values: Dict[str, Tuple[tuple, dict]] = {}
+        self.__unwrapped: Dict[str, Any] = {}
+
+        # runs a function once the event loop is idle, e.g. tk's after_idle
+        self.schedule = schedule
+        self.__posted: Dict[str, Tuple[tuple, dict]] = {}
+        self.__flush_pending = False
+
+    @staticmethod
+    def _reference(func: Callable) -> Callable:
+        """Creates a weak reference to bound methods and a strong one to other functions"""
+        if hasattr(func, "__self__") and hasattr(func, "__func__"):
+            return weakref.WeakMethod(func)
+        return lambda: func
 
     def set_funcs(self, hook: str, *funcs):
         """Stores given function(s) into a dictionary with given hook as key"""
-        if hook in self.__functions:
-            self.add_funcs(hook, *funcs)
-        else:
-            self.__functions[hook] = list(funcs)
+        self.add_funcs(hook, *funcs)
 
     def add_funcs(self, hook: str, *funcs):
         """Updates the dictionary with given function(s)"""
-        self.__functions[hook].append(*funcs)
+        registered = self.__functions.get(hook, ())
+        known = [ref() for ref in registered]
+        added = tuple(
+            self._reference(func) for func in dict.fromkeys(funcs) if func not in known
+        )
+        self.__functions[hook] = registered + added
 
     def add_values(self, hook: str, *args, **kwargs):
         """Stores given values(s) into a dictionary with given hook as key"""
-        self.__values[hook] = [args, kwargs]
+        self.__values[hook] = (args, kwargs)
+
+        # resolve the value once instead of on every read
+        if len(args) == 0:
+            self.__unwrapped[hook] = kwargs if kwargs else None
+        elif len(args) == 1 and len(kwargs) == 0:
+            self.__unwrapped[hook] = args[0]
+        elif len(kwargs) == 0:
+            self.__unwrapped[hook] = args
+        else:
+            self.__unwrapped[hook] = [args, kwargs]
 
     def call(self, hook: str, *args, **kwargs):
         """
         Calls function at the key 'hook" with ether the given arguments or/and
         values stored in itself at 'value_hook'
         """
+        if hook not in self.__functions:
+            raise ValueError("A function with this hook does not exists")
+
+        if "value_hook" in kwargs:
+            value_hook = kwargs.pop("value_hook")
+            args = self.__values[value_hook][0]
+            kwargs.update(self.__values[value_hook][1])
+
         result = []
-        # print(self.__functions[hook])
-        try:
-            for func in self.__functions[hook]:
-                if "value_hook" in kwargs:
-                    value_hook = kwargs.pop("value_hook")
-                    args = (*self.__values[value_hook][0],)
-                    kwargs.update(self.__values[value_hook][1])
+        dead = False
+        with METRICS.span("event", hook):
+            for ref in self.__functions[hook]:
+                func = ref()
+                if func is None:
+                    dead = True
+                    continue
                 result.append(func(*args, **kwargs))
 
-            return result if len(result) > 1 else result[0]
-        except KeyError:
-            raise ValueError("A function with this hook does not exists")
+        if dead:
+            self.__functions[hook] = tuple(
+                ref for ref in self.__functions[hook] if ref() is not None
+            )
 
-    def get_values(self, hook):
-        """Gets the value stored on the given hook"""
-        if len(self.__values[hook][0]) == 0:
-            if len(self.__values[hook][1]) == 0:
-                return None
-            return self.__values[hook][1]
+        if len(result) == 0:
+            return None
+        return result if len(result) > 1 else result[0]
 
-        if len(self.__values[hook][0]) == 1 and len(self.__values[hook][1]) == 0:
-            return self.__values[hook][0][0]
+    def post(self, hook: str, *args, **kwargs) -> None:
+        """Calls the functions of hook once the event loop is idle, merging repeated posts"""
+        if self.schedule is None:
+            self.call(hook, *args, **kwargs)
+            return
 
-        if len(self.__values[hook][1]) == 0:
-            return self.__values[hook][0]
-        return self.__values[hook]
+        # the latest arguments win, the position in the queue stays
+        self.__posted[hook] = (args, kwargs)
+        if not self.__flush_pending:
+            self.__flush_pending = True
+            self.schedule(self.flush)
+
+    def flush(self) -> None:
+        """Dispatches all posted events in the order they were first posted
+
+        A failing hook does not keep the others from being called, its error is
+        raised once all of them were dispatched.
+        """
+        self.__flush_pending = False
+        posted, self.__posted = self.__posted, {}
+        error: Optional[Exception] = None
+        for hook, (args, kwargs) in posted.items():
+            METRICS.count("event.posted")
+            try:
+                self.call(hook, *args, **kwargs)
+            except Exception as exc:  # skipcq: PYL-W0703
+                if error is None:
+                    error = exc
+        if error is not None:
+            raise error
+
+    def get_values(self, hook):
+        """Gets the value stored on the given hook"""
+        return self.__unwrapped[hook]
 
     def check_value(self, hook: str) -> bool:
         """Checks if a value at the given hook exists"""
@@ -79,17 +165,65 @@ class PyditorApplication(tk.Frame):
     """The Main Application Class bundling all the Components"""
 
     def __init__(self, parent, *args, **kwargs):
+        # backend rendering the pages: "serial", "thread" or "process"
+        if "backend" in kwargs:
+            backend = kwargs["backend"]
+            kwargs.pop("backend")
+        else:
+            backend = "serial"
+
+        # how documents are opened: "file", "mmap" or "memory"
+        if "open_mode" in kwargs:
+            self.openMode = kwargs["open_mode"]
+            kwargs.pop("open_mode")
+        else:
+            self.openMode = "file"
+
+        # record timings and counters of the hot paths from the start
+        if "metrics" in kwargs:
+            METRICS.enabled = kwargs["metrics"]
+            kwargs.pop("metrics")
+
         super().__init__(parent, *args, **kwargs)
 
-        # handler for communication between components
-        self.handler = EventHandler()
+        # handler for communication between components, deferring posted events
+        # to the next idle cycle of the event loop
+        self.handler = EventHandler(schedule=self.after_idle)
 
         # create placeholder document
         self.handler.add_values("document", fitz.Document())
+        self.handler.add_values("pages", PageModel())
+
+        # edits of the pages which can be undone
+        self.history = History(self.handler.get_values("pages"))
+
+        # text of the pages, indexed in the background once a document is opened
+        self.indexer: Optional[Indexer] = None
+        self.handler.add_values("text-index", None)
+
+        # thumbnails kept on disk to fill the sidebar quickly when reopening a file
+        try:
+            self.thumbnailStore: Optional[ThumbnailStore] = ThumbnailStore()
+        except OSError:
+            self.thumbnailStore = None
+
+        # cache of rendered pages shared by all page viewers
+        self.renderCache = RenderCache(store=self.thumbnailStore)
+        self.handler.add_values("render-cache", self.renderCache)
+        self.renderBackend = make_backend(backend)
+        self.handler.add_values("render-backend", self.renderBackend)
+
+        # other documents kept open to insert their pages, sharing the render cache
+        self.workspace = Workspace(cache=self.renderCache, open_mode=self.openMode)
 
         # == Attributes ==
         self.parent = parent
         self.sashpos = [(200, 1)]
+        self.loadedDocument: Optional[LoadedDocument] = None
+        self.openJob: Optional[OpenJob] = None
+        self.sourceJob: Optional[OpenJob] = None
+        self.saveJob: Optional[SaveJob] = None
+        self.saveDialog: Optional[ProgressDialog] = None
 
         # == Variables ==
         # variables for the column settings
@@ -127,6 +261,21 @@ class PyditorApplication(tk.Frame):
         self.selectionViewerTab = SideSelectionViewer(
             parent=self.sidebarTabs, event_handler=self.handler, direction="vertical"
         )
+        self.sourcesTab = tk.Frame(master=self.sidebarTabs)
+        self.sourcesBar = tk.Frame(master=self.sourcesTab)
+        self.sourceVar = tk.StringVar()
+        self.sourcePicker = ttk.Combobox(
+            master=self.sourcesBar, textvariable=self.sourceVar, state="readonly"
+        )
+        self.sourceAddButton = tk.Button(
+            master=self.sourcesBar, text="Add...", command=self.add_source
+        )
+        self.sourceCloseButton = tk.Button(
+            master=self.sourcesBar, text="Close", command=self.close_source
+        )
+        self.sourceViewer = SourceViewer(
+            parent=self.sourcesTab, event_handler=self.handler, direction="vertical"
+        )
 
         # -- document editor --
         self.editorFrame = tk.Frame(master=self.bodyPanel, bg="green")
@@ -138,6 +287,23 @@ class PyditorApplication(tk.Frame):
             direction="both",
         )
 
+        # -- text search --
+        self.searchBar = SearchBar(parent=self.toolbarFrame, event_handler=self.handler)
+
+        # state read whenever metrics are shown
+        viewers = (
+            self.pageViewerTab,
+            self.selectionViewerTab,
+            self.sourceViewer,
+            self.pageEditor,
+        )
+        METRICS.gauge(
+            "viewer.photo_bytes", lambda: sum(viewer.photo_bytes for viewer in viewers)
+        )
+        METRICS.gauge("cache.bytes", lambda: self.renderCache.size)
+        METRICS.gauge("cache.hit_rate", lambda: round(self.renderCache.hit_rate, 4))
+        METRICS.gauge("process.rss", resident_memory)
+
         # frame to store setting widgets
         self.editorSettingsFrame = tk.Frame(master=self.editorFrame, bg="blue")
         self.editorColumnSetting = ttk.OptionMenu(
@@ -159,7 +325,15 @@ class PyditorApplication(tk.Frame):
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         """Function to clean up and end the application"""
-        self.handler.get_values("document").close()
+        if self.openJob is not None:
+            self.openJob.cancel()
+        if self.sourceJob is not None:
+            self.sourceJob.cancel()
+        # the loaders may still render pages of the documents
+        self.release_document()
+        self.sourceViewer.close_source()
+        self.workspace.close()
+        self.renderBackend.close()
 
         # save application properties to later restore window how it was while closing
         # with open(".settings.json", "w") as f:
@@ -173,13 +347,14 @@ class PyditorApplication(tk.Frame):
         """Load the components for page-viewer"""
         # == toolbar ==
         toolbar = tk.Label(master=self.toolbarFrame, text="top_toolbar", bg="red")
-        toolbar.pack(pady=10)
+        toolbar.pack(side="left", pady=10)
+        self.searchBar.pack(side="right", padx=5)
 
         # == page viewer ==
         # collapsible Frame as widget container
         self.bodyPanel.add(self.pageViewerFrame)
 
-        # taps for ether displaying all page_label for navigation or the selection
+        # taps for ether displaying all pages for navigation or the selection
         self.sidebarTabs.pack(fill="both", expand=True)
 
         # Scrollable Frame to display pages of the document
@@ -190,6 +365,14 @@ class PyditorApplication(tk.Frame):
         self.selectionViewerTab.pack(fill="both", expand=True)
         self.sidebarTabs.add(self.selectionViewerTab, text="Selection")
 
+        # other open documents to take pages from
+        self.sourcesBar.pack(fill="x")
+        self.sourcePicker.pack(side="left", fill="x", expand=True, padx=2, pady=2)
+        self.sourceAddButton.pack(side="left")
+        self.sourceCloseButton.pack(side="left")
+        self.sourceViewer.pack(fill="both", expand=True)
+        self.sidebarTabs.add(self.sourcesTab, text="Sources")
+
         # == main document editor ==
         # Frame as widget container
         self.bodyPanel.add(self.editorFrame)
@@ -224,9 +407,22 @@ class PyditorApplication(tk.Frame):
 
         self.handler.set_funcs("jump-page", self.pageEditor.jump_to_page)
 
-        # bind functions updating pages when scale changed
-        self.editorScalingSetting.bind("<<ComboboxSelected>>", self.update_editor)
-        self.editorScalingSetting.bind("<Return>", self.update_editor)
+        # -- page editing --
+        self.handler.set_funcs("edit-pages", self.edit_pages)
+        self.handler.set_funcs("undo", self.undo)
+        self.handler.set_funcs("redo", self.redo)
+
+        # bind functions updating pages when scale changed, merging bursts of changes
+        self.handler.set_funcs("scale-changed", self.update_editor)
+        self.editorScalingSetting.bind(
+            "<<ComboboxSelected>>", lambda _: self.handler.post("scale-changed")
+        )
+        self.editorScalingSetting.bind(
+            "<Return>", lambda _: self.handler.post("scale-changed")
+        )
+
+        # -- sources --
+        self.sourcePicker.bind("<<ComboboxSelected>>", lambda _: self.show_source())
 
     def jump_to_selection(self, *_, **__):
         """Move to the second tab on the sidebar"""
@@ -246,14 +442,35 @@ class PyditorApplication(tk.Frame):
     def update_editor(self, *_):
         """Updates the dimensions of the editor after sash been relocated"""
         self.bodyPanel.update()
-        self.pageEditor.update_pages()
+        self.pageEditor.schedule_update()
 
     def update_column_value(self, selection):
         """Function to change the number of columns the document is displayed"""
         self.scaleVar.set("100%")
-        self.pageEditor.column = int(selection[0])
-        self.pageEditor.canvas.yview_moveto(0.0)
-        self.pageEditor.load_pages()
+        self.pageEditor.set_column(int(selection[0]))
+
+    def edit_pages(self, command: Command) -> None:
+        """Applies an edit to the pages and records it to be undone"""
+        if self.saveJob is not None:
+            return  # the pages are being written
+        self._pages_changed(self.history.execute(command))
+
+    def undo(self) -> None:
+        """Reverts the last edit of the pages"""
+        if self.saveJob is None and self.history.can_undo:
+            self._pages_changed(self.history.undo())
+
+    def redo(self) -> None:
+        """Applies the last reverted edit of the pages again"""
+        if self.saveJob is None and self.history.can_redo:
+            self._pages_changed(self.history.redo())
+
+    def _pages_changed(self, command: Command) -> None:
+        """Redraws the pages changed by a command in all viewers"""
+        if command.structural:
+            # the selected positions now hold other pages
+            self.pageEditor.clear_selection()
+        self.handler.call("pages-changed", command.first, command.last)
 
     def open_file(self):
         """Opens a filedialog and convert selected pdf-file to a 'fitz.Document'"""
@@ -266,15 +483,246 @@ class PyditorApplication(tk.Frame):
             self.set_document(pdf_file)
 
     def set_document(self, doc: str) -> None:
-        """Create document from path and load pages onto the viewer-frames"""
-        self.handler.add_values("document", fitz.Document(doc))
-        self.handler.call("set-document")
+        """Opens the document at path in the background and loads its pages once read
 
-        # rename title with according file path
-        self.parent.title("Pyditor - editing: " + doc)
+        The current document stays open until the new one is ready.
+        """
+        # only the document opened last is shown
+        if self.openJob is not None:
+            self.openJob.cancel()
+        self.openJob = OpenJob(doc, self.openMode, lock=MUPDF_LOCK).start()
+        self.parent.title("Pyditor - opening: " + doc)
+        self.after(50, self._poll_open, self.openJob)
+
+    def _poll_open(self, job: OpenJob) -> None:
+        """Loads the pages onto the viewer-frames once the document is read"""
+        if job is not self.openJob:
+            return  # another document was opened meanwhile
+        if not job.done:
+            self.parent.title(f"Pyditor - opening: {job.path} ({job.progress:.0%})")
+            self.after(50, self._poll_open, job)
+            return
+
+        self.openJob = None
+        loaded, pages = job.loaded, job.pages
+        if not job.succeeded or loaded is None or pages is None:
+            self._show_title()
+            messagebox.showerror(title="Opening failed", message=job.error)
+            return
+
+        self.release_document()
+        self.loadedDocument = loaded
+        document = loaded.document
+        self.handler.add_values("document", document)
+        self.handler.add_values("pages", pages)
+        self.history = History(pages)
+        # search results show up while the rest of the pages is indexed
+        self.indexer = Indexer(document).start()
+        self.handler.add_values("text-index", self.indexer)
+        # documents opened in quick succession are loaded only once
+        self.handler.post("set-document")
+
+        self._show_title()
+
+    def _show_title(self) -> None:
+        """Renames the title with the path of the edited document"""
+        if self.loadedDocument is not None:
+            self.parent.title("Pyditor - editing: " + self.loadedDocument.path)
+        else:
+            self.parent.title("Pyditor - edit PDFs")
+
+    def release_document(self) -> None:
+        """Closes the current document after the viewers and the cache let go of it"""
+        if self.loadedDocument is None:
+            return
+
+        self.handler.call("release-document")
+        if self.indexer is not None:
+            self.indexer.cancel()
+            self.indexer = None
+        self.renderCache.drop_document(self.loadedDocument.document)
+        with MUPDF_LOCK:
+            self.loadedDocument.close()
+        self.loadedDocument = None
+
+        self.handler.add_values("document", fitz.Document())
+        self.handler.add_values("pages", PageModel())
+        self.handler.add_values("text-index", None)
+
+    def add_source(self, path: str = "") -> None:
+        """Opens another document to insert its pages, asking for the file if no path is given"""
+        if not path:
+            path = askopenfilename(
+                title="Choose a PDF to take pages from:",
+                filetypes=[("PDF-Files", "*.pdf")],
+            )
+            if not path:
+                return
+
+        source = self.workspace.find(path)
+        if source is not None:
+            self.select_source(source)
+            return
+
+        # only the source added last is opened
+        if self.sourceJob is not None:
+            self.sourceJob.cancel()
+        self.sourceJob = self.workspace.open(path)
+        self.sourceVar.set("opening: " + os.path.basename(path))
+        self.sidebarTabs.select(self.sourcesTab)
+        self.after(50, self._poll_source, self.sourceJob)
+
+    def _poll_source(self, job: OpenJob) -> None:
+        """Adds a source to the workspace once it is read"""
+        if job is not self.sourceJob:
+            return  # another source was added meanwhile
+        name = os.path.basename(job.path)
+        if not job.done:
+            self.sourceVar.set(f"opening: {name} ({job.progress:.0%})")
+            self.after(50, self._poll_source, job)
+            return
+
+        self.sourceJob = None
+        if not job.succeeded:
+            self.sourceVar.set("")
+            if len(self.workspace) > 0:
+                self.select_source(self.workspace[0])
+            messagebox.showerror(title="Opening failed", message=job.error)
+            return
+
+        self.select_source(self.workspace.add(job))
+
+    def select_source(self, source: LoadedDocument) -> None:
+        """Lists the sources in the sources tab and shows the pages of the given one"""
+        self.sourcePicker.configure(
+            values=[os.path.basename(loaded.path) for loaded in self.workspace]
+        )
+        self.sourcePicker.current(list(self.workspace).index(source))
+        self.show_source()
+        self.sidebarTabs.select(self.sourcesTab)
+
+    @property
+    def current_source(self) -> Optional[LoadedDocument]:
+        """Gets the source chosen in the sources tab"""
+        index = self.sourcePicker.current()
+        return self.workspace[index] if 0 <= index < len(self.workspace) else None
+
+    def show_source(self) -> None:
+        """Shows the pages of the source chosen in the sources tab"""
+        source = self.current_source
+        if source is not None:
+            self.sourceViewer.show_source(self.workspace.pages(source))
+
+    def close_source(self) -> None:
+        """Closes the source chosen in the sources tab unless the document uses its pages"""
+        source = self.current_source
+        if source is None or self.saveJob is not None:
+            return
+
+        document = source.document
+        if self.handler.get_values("pages").uses(document):
+            messagebox.showinfo(
+                title="Source in use",
+                message="Pages of this document were inserted. "
+                "Save or remove them before closing it.",
+            )
+            return
+
+        # pages which could be pasted or restored must not outlive the document
+        if self.selectionViewerTab.pages.uses(document):
+            self.selectionViewerTab.clear_all()
+        if self.history.uses(document):
+            self.history.clear()
+
+        self.sourceViewer.close_source()
+        self.workspace.remove(source)
+
+        self.sourcePicker.configure(
+            values=[os.path.basename(loaded.path) for loaded in self.workspace]
+        )
+        if len(self.workspace) > 0:
+            self.sourcePicker.current(0)
+            self.show_source()
+        else:
+            self.sourceVar.set("")
 
     def save_file(self):
-        """Saves the edited pdf file using the metadata title as name"""
+        """Saves the edited pdf-file to the file it was opened from"""
+        document = self.handler.get_values("document")
+        if document.name:
+            self.start_save(document.name)
 
     def save_file_name(self):
         """Saves the edited pdf-file asking for a name"""
+        pdf_file = asksaveasfilename(
+            title="Save your PDF as:",
+            defaultextension=".pdf",
+            filetypes=[("PDF-Files", "*.pdf")],
+        )
+
+        if pdf_file:
+            self.start_save(pdf_file)
+
+    def start_save(self, path: str) -> None:
+        """Saves the pages in their current order to path in the background"""
+        document = self.handler.get_values("document")
+        if not document.name or self.saveJob is not None:
+            return
+
+        pages = self.handler.get_values("pages")
+        self.saveJob = SaveJob(
+            document.name,
+            path,
+            pages.numbers,
+            rotations=pages.rotations,
+            documents=[doc.name for doc in pages.documents],
+            origins=pages.sources,
+        ).start()
+        self.saveDialog = ProgressDialog(
+            self.parent,
+            text=f"Saving {path}",
+            command=self.cancel_save,
+        )
+        self.after(100, self._poll_save)
+
+    def cancel_save(self) -> None:
+        """Stops saving and restores the file as it was before"""
+        if self.saveJob is not None:
+            self.saveJob.cancel()
+
+    def _poll_save(self) -> None:
+        """Shows the progress of saving and reopens the document when finished"""
+        job, dialog = self.saveJob, self.saveDialog
+        if job is None or dialog is None:
+            return
+        if not job.done:
+            dialog.set(job.progress)
+            if job.mode != "auto":
+                dialog.label.configure(text=f"Saving {job.target} ({job.mode})")
+            self.after(100, self._poll_save)
+            return
+
+        dialog.destroy()
+        self.saveJob = None
+        self.saveDialog = None
+
+        if job.error:
+            messagebox.showerror(title="Saving failed", message=job.error)
+            return
+
+        if job.replace_pending:
+            # the open document keeps the file from being replaced on Windows
+            self.release_document()
+            try:
+                job.finish()
+            except OSError as error:
+                messagebox.showerror(
+                    title="Saving failed",
+                    message=f"{error}\nThe saved document was kept as {job.written}",
+                )
+                self.set_document(job.source)
+                return
+
+        if job.succeeded:
+            # continue editing the saved file
+            self.set_document(job.target)
@@ -0,0 +1,237 @@
+"""Headless page operations on many files without a display"""
+
+import getopt
+import multiprocessing
+import os
+import sys
+import time
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+import fitz  # PyMuPDF
+
+from document import apply_pages
+from pagemodel import PageModel
+
+__all__ = [
+    "OPERATIONS",
+    "parse_pages",
+    "edit_pages",
+    "output_path",
+    "process_file",
+    "merge",
+    "main",
+]
+
+USAGE = """
+Usage: pyditor batch OPERATION [PAGES] [OPTIONS] [FILE... | -]
+
+Operations:
+    reorder PAGES       Move the given pages to the front in the given order
+    extract PAGES       Keep only the given pages in the given order
+    delete PAGES        Remove the given pages
+    merge               Combine all files into the output file
+
+PAGES are numbers and ranges counting from 1, e.g. "3,1,5-7,10-".
+Files are read from standard input, one per line, if "-" is given.
+Files with a name written before are numbered, e.g. "scan-2.pdf".
+
+Options:
+    -o PATH             Output directory, or output file for merge
+    -j NUMBER           Number of worker processes (default: number of CPUs)
+"""
+
+OPERATIONS = ("reorder", "extract", "delete", "merge")
+
+# result of a processed file: path, pages written, bytes written, error
+Result = Tuple[str, int, int, str]
+
+
+def parse_pages(spec: str, count: int) -> List[int]:
+    """Converts a page spec counting from 1 into page indices of a document with count pages
+
+    Ranges may be open ended ("5-") or descending ("7-5").
+    """
+    indices = []
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, stop = part.split("-", 1)
+            first = int(start) if start else 1
+            last = int(stop) if stop else count
+            step = 1 if first <= last else -1
+            numbers = range(first, last + step, step)
+        else:
+            numbers = range(int(part), int(part) + 1)
+
+        for number in numbers:
+            if not 1 <= number <= count:
+                raise ValueError(f"Page {number} is out of range 1-{count}")
+            indices.append(number - 1)
+    return indices
+
+
+def edit_pages(pages: PageModel, operation: str, spec: str) -> PageModel:
+    """Applies an operation to the pages the same way the editor does"""
+    positions = parse_pages(spec, len(pages))
+
+    if operation == "extract":
+        return pages.subset(positions)
+    if operation == "reorder":
+        listed = set(positions)
+        rest = [i for i in range(len(pages)) if i not in listed]
+        return pages.subset(positions + rest)
+    if operation == "delete":
+        pages.remove(sorted(set(positions)))
+        return pages
+    raise ValueError(f"Unknown operation {operation!r}")
+
+
+def output_path(directory: str, source: str, used: Set[str]) -> str:
+    """Gets the path in directory to save source to, numbering names already used"""
+    stem, extension = os.path.splitext(os.path.basename(source))
+    name = stem + extension
+    number = 1
+    while name in used:
+        number += 1
+        name = f"{stem}-{number}{extension}"
+    used.add(name)
+    return os.path.join(directory, name)
+
+
+def process_file(job: Tuple[str, str, str, str]) -> Result:
+    """Applies an operation to one file and saves it to target"""
+    operation, spec, source, target = job
+    try:
+        with fitz.Document(source) as doc:
+            pages = edit_pages(PageModel.from_document(doc), operation, spec)
+            apply_pages(doc, pages.numbers, pages.rotations)
+            doc.save(target + ".part", garbage=3, deflate=True)
+        os.replace(target + ".part", target)
+        return source, len(pages), os.path.getsize(target), ""
+    except Exception as error:  # skipcq: PYL-W0703
+        return source, 0, 0, str(error)
+
+
+def merge(sources: Iterable[str], target: str) -> Iterator[Result]:
+    """Appends the pages of all sources to one document saved to target"""
+    with fitz.Document() as merged:
+        for source in sources:
+            try:
+                with fitz.Document(source) as doc:
+                    merged.insert_pdf(doc)
+                    yield source, len(doc), 0, ""
+            except Exception as error:  # skipcq: PYL-W0703
+                yield source, 0, 0, str(error)
+
+        if len(merged) == 0:
+            yield target, 0, 0, "No pages could be read, nothing was written"
+            return
+        merged.save(target + ".part", garbage=3, deflate=True)
+    os.replace(target + ".part", target)
+
+
+def read_paths(args: List[str]) -> Iterator[str]:
+    """Yields the given paths, reading them from standard input for "-" """
+    for arg in args:
+        if arg == "-":
+            yield from (line.strip() for line in sys.stdin if line.strip())
+        else:
+            yield arg
+
+
+def run(
+    operation: str,
+    spec: str,
+    paths: Iterable[str],
+    output: str,
+    workers: Optional[int] = None,
+) -> List[Result]:
+    """Runs an operation on all paths and prints the outcome of each file"""
+    results = []
+    if operation == "merge":
+        for result in merge(paths, output):
+            report(result)
+            results.append(result)
+        return results
+
+    os.makedirs(output, exist_ok=True)
+    # files of the same name from different directories must not overwrite each other
+    used: Set[str] = set()
+    jobs = ((operation, spec, path, output_path(output, path, used)) for path in paths)
+    with multiprocessing.Pool(workers) as pool:
+        # files are handed out while the paths are still being read
+        for result in pool.imap_unordered(process_file, jobs, chunksize=4):
+            report(result)
+            results.append(result)
+    return results
+
+
+def report(result: Result) -> None:
+    """Prints the outcome of one file"""
+    path, pages, _, error = result
+    if error:
+        print(f"failed  {path}: {error}", file=sys.stderr)
+    else:
+        print(f"done    {path} ({pages} pages)")
+
+
+def summarize(results: List[Result], seconds: float, output: str) -> str:
+    """Describes the throughput of a batch run"""
+    failed = sum(1 for result in results if result[3])
+    pages = sum(result[1] for result in results)
+    written = sum(result[2] for result in results)
+    if os.path.isfile(output):
+        written = os.path.getsize(output)  # merged into one file
+
+    seconds = max(seconds, 1e-9)
+    return (
+        f"{len(results) - failed} files, {failed} failed, {pages} pages, "
+        f"{written / 1024 ** 2:.1f} MiB written in {seconds:.2f} s "
+        f"({len(results) / seconds:.1f} files/s, {pages / seconds:.1f} pages/s)"
+    )
+
+
+def main(argv: List[str]) -> int:
+    """Entry point of the batch mode returning the exit status"""
+    if not argv or argv[0] not in OPERATIONS:
+        print(USAGE)
+        return 1
+    operation, argv = argv[0], argv[1:]
+
+    spec = ""
+    if operation != "merge":
+        if not argv:
+            print(USAGE)
+            return 1
+        spec, argv = argv[0], argv[1:]
+
+    try:
+        opts, args = getopt.gnu_getopt(argv, shortopts="o:j:")
+    except getopt.GetoptError as error:
+        print(f"{error}\n{USAGE}")
+        return 1
+
+    output = ""
+    workers = None
+    for opt, arg in opts:
+        if opt == "-o":
+            output = arg.strip()
+        elif opt == "-j":
+            if not arg.strip().isdigit() or int(arg) < 1:
+                print(f"-j needs a positive number of workers, got {arg!r}\n{USAGE}")
+                return 1
+            workers = int(arg)
+
+    if not output or not args:
+        print(USAGE)
+        return 1
+
+    start = time.perf_counter()
+    results = run(operation, spec, read_paths(args), output, workers)
+    print(summarize(results, time.perf_counter() - start, output))
+    return 1 if any(result[3] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,589 @@
+"""Reproducible benchmarks of the render, viewer, edit and save paths
+
+Documents are generated with fitz, so every run measures the same input.
+Results can be written to a JSON file and compared with the results of
+another commit:
+
+    python benchmarks.py -n 10,1000 -k text,image -o new.json -c old.json
+
+Viewer benchmarks need a display. Without one they run under Xvfb if it is
+installed and are skipped otherwise.
+"""
+
+import getopt
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from document import SaveJob
+from history import Command, History
+from pagemodel import PageModel
+from rendering import (
+    BACKENDS,
+    PageImage,
+    RenderCache,
+    fit_zoom,
+    make_backend,
+    render_page,
+    render_tile,
+)
+from selection import Selection
+
+# target widths of a rendered page in pixels as they appear in the application
+TARGETS: Dict[str, int] = {
+    "sidebar thumbnail": 180,
+    "editor 2 per row 100%": 600,
+    "editor 2 per row 200%": 1200,
+}
+
+# page width and viewport rendered by the tiles suite, a zoomed in single column
+TILED_WIDTH = 2400
+VIEWPORT = (1000, 800)
+TILE_SIZE = 512
+
+# kinds of synthetic documents
+KINDS = ("text", "image", "mixed")
+
+# paper sizes cycled through by mixed documents
+PAPERS = ("a4", "letter", "a3", "a5-l", "a4-l", "legal")
+
+# rendering every page of huge documents takes too long, so render a sample
+RENDER_SAMPLE = 200
+
+Record = Dict[str, Any]
+
+# values every result has, others are specific to a suite
+FIELDS = ("suite", "case", "seconds", "per_second", "document", "pages")
+
+
+def make_document(pages: int, kind: str = "text") -> fitz.Document:
+    """Creates a synthetic document with the given number of pages
+
+    Text documents hold a page of text, image documents a full page image and
+    mixed documents both on pages of varying paper sizes.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Kind must be one of {', '.join(KINDS)}")
+
+    doc = fitz.Document()
+    text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40
+    images: List[int] = []  # xrefs of the images, inserted once and reused
+
+    for i in range(pages):
+        if kind == "mixed":
+            rect = fitz.paper_rect(PAPERS[i % len(PAPERS)])
+            page = doc.new_page(width=rect.width, height=rect.height)
+        else:
+            page = doc.new_page()
+        area = page.rect + (72, 100, -72, -72)
+
+        if kind != "image":
+            page.insert_text((72, 72), f"Page {i + 1}", fontsize=24)
+            page.insert_textbox(area, text, fontsize=11)
+            page.draw_rect(page.rect + (60, 60, -60, -60), color=(0, 0, 1))
+
+        if kind == "image" or (kind == "mixed" and i % 3 == 0):
+            if len(images) < 8:
+                images.append(page.insert_image(area, stream=make_image(len(images))))
+            else:
+                page.insert_image(area, xref=images[i % len(images)])
+
+    return doc
+
+
+def make_image(seed: int) -> bytes:
+    """Creates a noisy PNG image which does not compress well"""
+    img = Image.effect_noise((800, 1000), 64 + seed * 8).convert("RGB")
+    with tempfile.SpooledTemporaryFile() as file:
+        img.save(file, "PNG")
+        file.seek(0)
+        return file.read()
+
+
+def legacy_render(page: fitz.Page, width: int) -> Image.Image:
+    """The former render path: rasterize at 72 dpi and resize the image in PIL"""
+    pix = page.get_pixmap()
+    mode = "RGBA" if pix.alpha else "RGB"
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+    scale = width / img.size[0]
+    return img.resize((int(img.size[0] * scale), int(img.size[1] * scale)))
+
+
+def direct_render(page: fitz.Page, width: int) -> PageImage:
+    """The current render path: rasterize once at the final size"""
+    return render_page(page, fit_zoom(page.rect, width=width))
+
+
+def draft_render(page: fitz.Page, width: int) -> PageImage:
+    """The render path while scrolling: less anti-aliasing and no annotations"""
+    return render_page(page, fit_zoom(page.rect, width=width), draft=True)
+
+
+def gray_draft_render(page: fitz.Page, width: int) -> PageImage:
+    """The draft render path in grayscale"""
+    return render_page(page, fit_zoom(page.rect, width=width), draft=True, gray=True)
+
+
+def sample(doc: fitz.Document) -> List[fitz.Page]:
+    """Gets up to RENDER_SAMPLE pages spread evenly over the document"""
+    step = max(len(doc) // RENDER_SAMPLE, 1)
+    return [doc[i] for i in range(0, len(doc), step)][:RENDER_SAMPLE]
+
+
+def timed(function: Callable, *args) -> float:
+    """Calls function and returns the elapsed seconds"""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def record(suite: str, case: str, seconds: float, count: int = 1, **extra) -> Record:
+    """Creates a result measuring count operations in seconds"""
+    return {
+        "suite": suite,
+        "case": case,
+        "seconds": seconds,
+        "per_second": count / seconds if seconds else 0.0,
+        **extra,
+    }
+
+
+def bench_render(path: str) -> List[Record]:
+    """Compares the legacy, the direct and the draft render paths for each target size"""
+    results = []
+    with fitz.Document(path) as doc:
+        pages = sample(doc)
+        for name, width in TARGETS.items():
+            for render in (
+                legacy_render,
+                direct_render,
+                draft_render,
+                gray_draft_render,
+            ):
+                seconds = timed(lambda: [render(page, width) for page in pages])
+                case = f"{render.__name__} {name}"
+                results.append(record("render", case, seconds, len(pages)))
+    return results
+
+
+def bench_backends(path: str) -> List[Record]:
+    """Renders a sample of pages with each render backend"""
+    results = []
+    with fitz.Document(path) as doc:
+        pages = sample(doc)
+        zooms = [
+            fit_zoom(page.rect, width=TARGETS["editor 2 per row 100%"])
+            for page in pages
+        ]
+        for name in BACKENDS:
+            backend = make_backend(name)
+            seconds = timed(RenderCache().render_pages, pages, zooms, backend)
+            backend.close()
+            results.append(record("backends", name, seconds, len(pages)))
+    return results
+
+
+def bench_tiles(path: str) -> List[Record]:
+    """Compares rendering whole zoomed in pages with rendering the tiles in view"""
+    results = []
+    with fitz.Document(path) as doc:
+        pages = sample(doc)[:20]
+        zooms = [fit_zoom(page.rect, width=TILED_WIDTH) for page in pages]
+
+        imgs: List[PageImage] = []
+        seconds = timed(lambda: imgs.extend(map(render_page, pages, zooms)))
+        nbytes = sum(img.nbytes for img in imgs)
+        results.append(
+            record("tiles", "whole pages", seconds, len(pages), bytes=nbytes)
+        )
+
+        boxes = [
+            (x, y, x + TILE_SIZE, y + TILE_SIZE)
+            for y in range(0, VIEWPORT[1], TILE_SIZE)
+            for x in range(0, VIEWPORT[0], TILE_SIZE)
+        ]
+        imgs.clear()
+        seconds = timed(
+            lambda: imgs.extend(
+                render_tile(page, zoom, box)
+                for page, zoom in zip(pages, zooms)
+                for box in boxes
+            )
+        )
+        nbytes = sum(img.nbytes for img in imgs)
+        results.append(
+            record("tiles", "viewport tiles", seconds, len(pages), bytes=nbytes)
+        )
+    return results
+
+
+def bench_transfer(path: str) -> List[Record]:
+    """Compares the ways of handing rendered pixmaps over to Tk
+
+    Only the copies made before Tk takes the image are timed and measured, as
+    Tk needs a display. The bytes copied per page are the lengths of the
+    buffers each way produces, without the copy Tk makes into the photo image.
+    """
+    results = []
+    with fitz.Document(path) as doc:
+        pages = sample(doc)
+        zooms = [
+            fit_zoom(page.rect, width=TARGETS["editor 2 per row 100%"])
+            for page in pages
+        ]
+        pixmaps = [
+            page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            for page, zoom in zip(pages, zooms)
+        ]
+
+        def through_pil() -> None:
+            for pix in pixmaps:
+                img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+                img.convert("RGBA")  # the block ImageTk hands to Tk
+
+        seconds = timed(through_pil)
+        copied = 0
+        for pix in pixmaps:
+            samples = pix.samples
+            img = Image.frombytes("RGB", (pix.width, pix.height), samples)
+            rgba = img.convert("RGBA")
+            copied += len(samples) + len(img.tobytes()) + len(rgba.tobytes())
+        results.append(
+            record(
+                "transfer",
+                "pil",
+                seconds,
+                len(pages),
+                copied_per_page=copied // len(pixmaps),
+            )
+        )
+
+        seconds = timed(lambda: [PageImage.from_pixmap(pix) for pix in pixmaps])
+        copied = sum(PageImage.from_pixmap(pix).nbytes for pix in pixmaps)
+        results.append(
+            record(
+                "transfer",
+                "pnm",
+                seconds,
+                len(pages),
+                copied_per_page=copied // len(pixmaps),
+            )
+        )
+    return results
+
+
+def bench_open(path: str) -> List[Record]:
+    """Opens the document and reads the geometry of all its pages"""
+    start = time.perf_counter()
+    doc = fitz.Document(path)
+    opened = time.perf_counter() - start
+    model = PageModel.from_document(doc)
+    modeled = time.perf_counter() - start - opened
+    doc.close()
+    return [
+        record("open", "open document", opened),
+        record("open", "page model", modeled, len(model)),
+    ]
+
+
+def bench_save(path: str) -> List[Record]:
+    """Saves the reversed document incrementally and fully"""
+    results = []
+    with fitz.Document(path) as doc:
+        pages = len(doc)
+    order = list(reversed(range(pages)))
+    size = os.path.getsize(path)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # incremental saves write into the file itself, so work on a copy
+        copy = os.path.join(directory, "incremental.pdf")
+        shutil.copy(path, copy)
+        full = os.path.join(directory, "full.pdf")
+
+        for mode, target, source in (
+            ("incremental", copy, copy),
+            ("full", full, path),
+        ):
+            job = SaveJob(source, target, order, mode=mode)
+            seconds = timed(lambda: job.start().wait())
+            output = os.path.getsize(target)
+            written = output - size if mode == "incremental" else output
+            results.append(record("save", job.mode, seconds, pages, written=written))
+    return results
+
+
+def bench_edit(path: str) -> List[Record]:
+    """Cuts, pastes, moves and undoes pages of the page model"""
+    with fitz.Document(path) as doc:
+        model = PageModel.from_document(doc)
+    history = History(model)
+
+    # every third page, as a scattered selection of the editor
+    selection = list(range(0, len(model), 3))
+    cut = Command.delete(selection, name="cut")
+    results = [record("edit", "cut", timed(history.execute, cut), len(selection))]
+
+    pages = cut.deltas[0].pages
+    assert pages is not None  # filled in by executing the cut
+    paste = Command.insert(len(model) // 2, pages)
+    results.append(record("edit", "paste", timed(history.execute, paste), len(pages)))
+
+    move = Command.move(range(len(model) // 4), len(model) // 2)
+    results.append(record("edit", "move", timed(history.execute, move)))
+
+    results.append(
+        record("edit", "undo all", timed(lambda: [history.undo() for _ in range(3)]), 3)
+    )
+    results.append(
+        record("edit", "redo all", timed(lambda: [history.redo() for _ in range(3)]), 3)
+    )
+
+    # selecting all pages with a shift click and deselecting them again
+    selected = Selection()
+    count = len(model)
+    results.append(
+        record("edit", "select range", timed(selected.add_range, 0, count), count)
+    )
+    results.append(record("edit", "clear selection", timed(selected.clear), count))
+    return results
+
+
+def start_display() -> Optional[subprocess.Popen]:
+    """Starts a virtual display if there is none and returns its process"""
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        return None
+    if shutil.which("Xvfb") is None:
+        return None
+
+    number = next(
+        n for n in range(90, 200) if not os.path.exists(f"/tmp/.X11-unix/X{n}")
+    )
+    process = subprocess.Popen(
+        ["Xvfb", f":{number}", "-screen", "0", "1600x1200x24", "-nolisten", "tcp"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(50):
+        if os.path.exists(f"/tmp/.X11-unix/X{number}"):
+            break
+        time.sleep(0.1)
+    os.environ["DISPLAY"] = f":{number}"
+    return process
+
+
+def bench_viewer(path: str) -> List[Record]:
+    """Loads, rescales, selects and jumps through the pages of the editor"""
+    # imported here, so the other benchmarks run without tkinter
+    import tkinter as tk
+
+    from app import EventHandler
+    from components import PagesEditor
+
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        print("viewer benchmarks skipped: no display", file=sys.stderr)
+        return []
+    root.geometry("1200x900")
+
+    def settle() -> None:
+        """Processes events until all visible pages are shown"""
+        root.update()
+        while not editor.idle:
+            root.update()
+            time.sleep(0.001)
+
+    doc = fitz.Document(path)
+    handler = EventHandler()
+    handler.add_values("document", doc)
+    handler.add_values("pages", PageModel.from_document(doc))
+    handler.add_values("render-cache", RenderCache())
+    scale = tk.StringVar(value="100%")
+    editor = PagesEditor(
+        parent=root, event_handler=handler, column=2, scale=scale, direction="both"
+    )
+    editor.pack(fill="both", expand=True)
+    root.update()
+
+    def load_pages() -> None:
+        editor.set_document()
+        settle()
+
+    def update_pages() -> None:
+        editor.update_pages()
+        settle()
+
+    def jump_to_pages() -> None:
+        for target in targets:
+            editor.jump_to_page(target)
+            settle()
+
+    results = [record("viewer", "load_pages", timed(load_pages))]
+
+    scale.set("150%")
+    results.append(record("viewer", "update_pages", timed(update_pages)))
+
+    count = len(editor.pages)
+    targets = [count * i // 20 for i in range(20)]
+    results.append(record("viewer", "jump_to_page", timed(jump_to_pages), len(targets)))
+
+    # select all pages with a click on the first and a shift click on the last
+    editor.jump_to_page(count - 1)
+    settle()
+    x, y = editor.canvas.coords(editor.page_items[count - 1])
+    click = SimpleNamespace(
+        x=x - editor.canvas.canvasx(0), y=y - editor.canvas.canvasy(0)
+    )
+    editor.last_selected = 0
+    results.append(
+        record("viewer", "select range", timed(editor.select_pages_shift, click), count)
+    )
+    results.append(
+        record("viewer", "clear selection", timed(editor.clear_selection), count)
+    )
+
+    root.destroy()
+    doc.close()
+    return results
+
+
+SUITES: Dict[str, Callable[[str], List[Record]]] = {
+    "render": bench_render,
+    "backends": bench_backends,
+    "tiles": bench_tiles,
+    "transfer": bench_transfer,
+    "open": bench_open,
+    "save": bench_save,
+    "edit": bench_edit,
+    "viewer": bench_viewer,
+}
+
+
+def run(suites: List[str], sizes: List[int], kinds: List[str]) -> List[Record]:
+    """Runs the suites on generated documents of every kind and size"""
+    results = []
+    display = start_display() if "viewer" in suites else None
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for kind in kinds:
+                for pages in sizes:
+                    # the process backend and saving work on files
+                    path = os.path.join(directory, f"{kind}-{pages}.pdf")
+                    make_document(pages, kind).save(path)
+
+                    for suite in suites:
+                        for result in SUITES[suite](path):
+                            result.update(document=kind, pages=pages)
+                            print(format_record(result))
+                            results.append(result)
+    finally:
+        if display is not None:
+            display.terminate()
+    return results
+
+
+def metadata() -> Dict[str, Any]:
+    """Describes the environment the benchmarks ran in"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ""
+
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pymupdf": fitz.VersionBind,
+        "cpus": os.cpu_count(),
+    }
+
+
+def format_record(result: Record) -> str:
+    """Formats a result as a table row followed by the extra values measured"""
+    extra = "".join(
+        f"  {key}={value}" for key, value in result.items() if key not in FIELDS
+    )
+    return (
+        f"{result['suite']:<10}{result['case']:<40}{result['document']:<7}"
+        f"{result['pages']:>7}{result['seconds']:>11.4f}s{result['per_second']:>12.1f}/s"
+        + extra
+    )
+
+
+def compare(results: List[Record], baseline: List[Record]) -> None:
+    """Prints how much faster each result is than the same result of the baseline"""
+    former = {
+        (r["suite"], r["case"], r["document"], r["pages"]): r["seconds"]
+        for r in baseline
+    }
+    print(f"\n{'suite':<10}{'case':<40}{'document':<9}{'pages':>7}{'speedup':>10}")
+    for result in results:
+        key = (result["suite"], result["case"], result["document"], result["pages"])
+        if key in former and result["seconds"]:
+            speedup = former[key] / result["seconds"]
+            print(f"{key[0]:<10}{key[1]:<40}{key[2]:<9}{key[3]:>7}{speedup:>9.2f}x")
+
+
+USAGE = (
+    "Usage: python benchmarks.py [-n pages,...] [-k text,image,mixed] "
+    f"[-o results.json] [-c baseline.json] [{' | '.join(SUITES)}]"
+)
+
+
+if __name__ == "__main__":
+    page_counts = [500]
+    document_kinds = ["text"]
+    output = ""
+    baseline_file = ""
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopts="n:k:o:c:h")
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == "-n":
+            page_counts = [int(n) for n in arg.split(",")]
+        elif opt == "-k":
+            document_kinds = arg.split(",")
+        elif opt == "-o":
+            output = arg
+        elif opt == "-c":
+            baseline_file = arg
+        elif opt == "-h":
+            print(USAGE)
+            sys.exit()
+
+    unknown = set(args).difference(SUITES) or set(document_kinds).difference(KINDS)
+    if unknown:
+        print(f"Unknown suite or kind: {', '.join(sorted(unknown))}\n{USAGE}")
+        sys.exit(1)
+
+    measured = run(args or list(SUITES), page_counts, document_kinds)
+
+    if output:
+        with open(output, "w") as file:
+            json.dump({"meta": metadata(), "results": measured}, file, indent=2)
+
+    if baseline_file:
+        with open(baseline_file) as file:
+            compare(measured, json.load(file)["results"])
@@ -1,69 +1,80 @@
+import bisect
 import re
 import tkinter as tk
 from tkinter import messagebox
+from typing import Dict, List, Optional, Set, Tuple
 
-from PIL import Image
+import fitz  # PyMuPDF
 
+from history import Command
+from pagemodel import PageModel
+from search import hit_rects
+from selection import Selection
+from rendering import MUPDF_LOCK, fit_zoom
 from widgets import PageViewer
 
-__all__ = ["SidePageViewer", "SideSelectionViewer", "PagesEditor"]
+__all__ = [
+    "SidePageViewer",
+    "SideSelectionViewer",
+    "SourceViewer",
+    "PagesEditor",
+    "SearchBar",
+]
 
 
 class OneColumnPageViewer(PageViewer):
     """Class for displaying pages on a side bar"""
 
-    def convert_page(self, page, scaling):
-        """Covert a given page object to a displayable Image and resize it"""
-        pix = page.get_pixmap()
+    def page_zoom(self, rect, scaling) -> float:
+        """Calculates the zoom factor to render a page rect to fit the sidebar width"""
+        zoom = fit_zoom(
+            rect, width=(self.canvas_width - self.offset_horizontal) / self.column
+        )
 
-        # set the mode depending on alpha
-        mode = "RGBA" if pix.alpha else "RGB"
-        img = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
+        return zoom * scaling
 
-        # rescale image to fit in the frame
-        # print(f"((({self.canvas_width} - {self.offset_horizontal}) / {self.column}) / {img.size[0]})")  # skipcq
-        scale = ((self.canvas_width - self.offset_horizontal) / self.column) / img.size[
-            0
-        ]
-        scale *= scaling
 
-        scaleImg = img.resize((int(img.size[0] * scale), int(img.size[1] * scale)))
+class SidePageViewer(OneColumnPageViewer):
+    """Scrollable Frame to display and select a single page of a pdf document"""
 
-        return scaleImg
+    show_titles = True
 
+    def __init__(self, parent, *args, **kwargs):
+        super().__init__(parent, *args, **kwargs)
+        self.selected: Optional[int] = None
 
-class SidePageViewer(OneColumnPageViewer):
-    """Scrollable Frame to display and select a single page of a pdf document"""
+        # bind an event whenever a page is clicked to select it
+        self.canvas.bind("<Button-1>", func=self.select_page)
+
+        # follow edits of the pages
+        self.handler.set_funcs("pages-changed", self.refresh_pages)
 
     def _leave_frame(self, _event):
         """Clears selection after mouse left widget"""
         super()._leave_frame(_event)
         self.clear_selection()
 
-    def load_pages(self) -> None:
-        """Displays all pages of the document vertically"""
-        super().load_pages()
-
-        for i, label in enumerate(self.page_label, 1):
-            # add title to page
-            label.config(text=f"Page {i}")
-
-            # bind an event whenever a page is clicked to select it
-            label.bind("<Button-1>", func=self.select_page)
-
     def clear_selection(self) -> None:
         """Remove selected pages from selection and reset page background"""
-        for widget in self.viewPort.winfo_children():
-            widget.config(bg="#cecfd0")
+        self.selected = None
+        self.clear_highlights()
+
+    def is_selected(self, index: int) -> bool:
+        """Checks if the page at index is selected"""
+        return index == self.selected
 
     def select_page(self, event: tk.Event) -> None:
         """Select page"""
-        self.clear_selection()
+        index = self.index_at(event)
+        if index is None:
+            return
 
-        event.widget.config(bg="blue")
+        self.clear_selection()
+        self.selected = index
+        self.highlight(index)
 
         # jump with added page viewer to selected page
-        self.handler.call("jump-page", event.widget.id)
+        self.handler.call("jump-page", index)
 
 
 class SideSelectionViewer(OneColumnPageViewer):
@@ -73,6 +84,7 @@ class SideSelectionViewer(OneColumnPageViewer):
         super().__init__(parent, *args, **kwargs)
 
         self.handler.set_funcs("get-selection", self.get_selection)
+        self.handler.set_funcs("selected-pages", self.selected_pages)
 
         # == right-click popup menu ==
         self.popupMenu = tk.Menu(master=self.canvas, tearoff=False)
@@ -100,23 +112,132 @@ class SideSelectionViewer(OneColumnPageViewer):
 
     def get_selection(self, selection):
         """Gets selection from page editor"""
-        sorted(selection)
-        for page_num in set(selection):
-            self.pages.append(self.handler.get_values("document")[page_num])
+        # reuse the geometry of the editor pages without touching the document
+        self.pages.extend(self.handler.get_values("pages").subset(selection))
 
         self.load_pages()
 
+    def selected_pages(self) -> PageModel:
+        """Gets a copy of the collected pages to paste them"""
+        return self.pages.subset(range(len(self.pages)))
+
     def clear_all(self):
         """Clears all displayed pages"""
-        for widget in self.viewPort.winfo_children():
-            widget.destroy()
-
+        self.clear()
         self.pages.clear()
 
 
+class SourceViewer(OneColumnPageViewer):
+    """View the pages of another open document to insert them into the edited one"""
+
+    show_titles = True
+
+    def __init__(self, parent, *args, **kwargs):
+        super().__init__(parent, *args, **kwargs)
+
+        # selected pages
+        self.selection = Selection()
+
+        # bind selection functionality to pages
+        self.canvas.bind("<Button-1>", func=self.select_page)
+        self.canvas.bind("<Control-Button-1>", func=self.select_pages_control)
+
+        # == right-click popup menu ==
+        self.popupMenu = tk.Menu(master=self.canvas, tearoff=False)
+        self.popupMenu.add_command(
+            label="Insert into document", command=self.insert_selected
+        )
+        self.popupMenu.add_separator()
+        self.popupMenu.add_command(
+            label="Clear selection", command=self.clear_selection
+        )
+
+    def set_document(self):
+        """Keeps showing the source when another document is edited"""
+
+    def release_document(self) -> None:
+        """Keeps showing the source when the edited document is closed"""
+
+    def show_source(self, pages: PageModel) -> None:
+        """Shows the pages of a source document"""
+        self.clear_selection()
+        self.clear()
+        self.pages = pages
+        self.load_pages()
+
+    def close_source(self) -> None:
+        """Drops the pages of the shown source so it can be closed"""
+        try:
+            self.clear_selection()
+        except tk.TclError:
+            pass  # the canvas was destroyed with the window
+        super().release_document()
+
+    def _enter_frame(self, _event):
+        """Bind popup-Menu when mouse enters component"""
+        super()._enter_frame(_event)
+        self.canvas.bind_all("<Button-3>", self.popup)
+
+    def _leave_frame(self, _event):
+        """Unbind popup-Menu when mouse leaves component"""
+        super()._leave_frame(_event)
+        self.canvas.unbind_all("<Button-3>")
+
+    def popup(self, event):
+        """Show popup menu"""
+        self.popupMenu.tk_popup(event.x_root, event.y_root)
+
+    def page_title(self, index: int) -> str:
+        """Gets the title drawn below the page at index"""
+        return f"Page {self.pages.numbers[index] + 1}"
+
+    def insert_selected(self) -> None:
+        """Inserts the selected pages or else all pages into the edited document"""
+        positions = (
+            self.selection.positions() if self.selection else range(len(self.pages))
+        )
+        if len(self.pages) > 0:
+            self.handler.call(
+                "insert-pages", self.pages.subset(positions), name="insert"
+            )
+
+    def select_page(self, event):
+        """Selects a single page"""
+        index = self.index_at(event)
+        if index is None:
+            return
+
+        selected = index in self.selection
+        self.clear_selection()
+        if not selected:
+            self.selection.add(index)
+            self.highlight(index)
+
+    def select_pages_control(self, event):
+        """Selects multiple pages by holding control"""
+        index = self.index_at(event)
+        if index is None:
+            return
+
+        self.selection.toggle(index)
+        self.highlight(index, index in self.selection)
+
+    def clear_selection(self):
+        """Removes all pages from selection"""
+        self.selection.clear()
+        self.clear_highlights()
+
+    def is_selected(self, index: int) -> bool:
+        """Checks if the page at index is selected"""
+        return index in self.selection
+
+
 class PagesEditor(PageViewer):
     """Page editor combinable with a combobox for scaling"""
 
+    mark_color = "orange"  # outline of the found text
+    tile_threshold = 1024 * 1024  # zoomed in pages are rendered in tiles
+
     def __init__(self, parent, *args, **kwargs):
         # arguments
         if "scale" in kwargs:
@@ -134,18 +255,39 @@ class PagesEditor(PageViewer):
         super().__init__(parent, *args, **kwargs)
 
         # selected pages
-        self.handler.add_values("selection", [])
-        # self.selection: list = []
+        self.selection = Selection()
+        self.handler.add_values("selection", self.selection)
         self.last_selected: int = 0
 
+        # bind selection functionality to pages
+        self.canvas.bind("<Button-1>", func=self.select_page)
+        self.canvas.bind("<Control-Button-1>", func=self.select_pages_control)
+        self.canvas.bind("<Shift-Button-1>", func=self.select_pages_shift)
+
+        # follow edits of the pages
+        self.handler.set_funcs("pages-changed", self.refresh_pages)
+        self.handler.set_funcs("insert-pages", self.insert_pages)
+
+        # text found by the search bar, outlined on the pages in view
+        self.marked = ""
+        self._marked_pages: Set[int] = set()
+        self._mark_rects: Dict[Tuple[int, int], List[fitz.Rect]] = {}
+        self.handler.set_funcs("mark-text", self.mark_text)
+
         # == right-click popup menu ==
         self.popupMenu = tk.Menu(master=self.canvas, tearoff=False)
         self.popupMenu.add_command(label="Copy", command=self.copy_selected)
         self.popupMenu.add_command(label="Cut", command=self.cut_selected)
         self.popupMenu.add_command(label="Past", command=self.past_selected)
+        self.popupMenu.add_command(label="Delete", command=self.delete_selected)
+        self.popupMenu.add_command(label="Rotate", command=self.rotate_selected)
         self.popupMenu.add_separator()
-        self.popupMenu.add_command(label="Undo")
-        self.popupMenu.add_command(label="Redo")
+        self.popupMenu.add_command(
+            label="Undo", command=lambda: self.handler.call("undo")
+        )
+        self.popupMenu.add_command(
+            label="Redo", command=lambda: self.handler.call("redo")
+        )
 
     def _enter_frame(self, _event):
         """Bind popup-Menu when mouse enters component"""
@@ -168,62 +310,135 @@ class PagesEditor(PageViewer):
 
     def cut_selected(self):
         """Sends selected pages to selection viewer and removes them"""
-        raise NotImplementedError()
+        if self.selection:
+            self.copy_selected()
+            self.handler.call(
+                "edit-pages", Command.delete(self.selection.positions(), name="cut")
+            )
 
     def past_selected(self):
         """Gets pages from selection viewer and pastes them into the document"""
-        raise NotImplementedError()
-
-    def load_pages(self) -> None:
-        """Binds selection functionality to pages"""
-        super().load_pages()
-
-        for page in self.page_label:
-            page.bind("<Button-1>", func=self.select_page)
-            page.bind("<Control-Button-1>", func=self.select_pages_control)
-            page.bind("<Shift-Button-1>", func=self.select_pages_shift)
+        self.insert_pages(self.handler.call("selected-pages"))
+
+    def insert_pages(self, pages: PageModel, name: str = "paste") -> None:
+        """Inserts pages of any open document in front of the selected pages or else at the end"""
+        if len(pages) == 0:
+            return
+
+        position = self.selection.first if self.selection else len(self.pages)
+        self.handler.call("edit-pages", Command.insert(position, pages, name=name))
+
+    def move_pages(self, positions, position: int) -> None:
+        """Moves the pages at positions in front of the page at position in one edit"""
+        positions = sorted(set(positions))
+        # the target counts the pages left after taking out the moved ones
+        target = position - bisect.bisect_left(positions, position)
+        if positions and positions != list(range(target, target + len(positions))):
+            self.handler.call("edit-pages", Command.move(positions, target))
+
+    def delete_selected(self):
+        """Removes the selected pages from the document"""
+        if self.selection:
+            self.handler.call("edit-pages", Command.delete(self.selection.positions()))
+
+    def rotate_selected(self, angle: int = 90):
+        """Turns the selected pages clockwise"""
+        if self.selection:
+            self.handler.call(
+                "edit-pages", Command.rotate(self.selection.positions(), angle)
+            )
 
     def select_page(self, event):
         """Selects page with a single right-click"""
-        if event.widget.id in self.handler.get_values("selection"):
-            self.clear_selection()
-        else:
-            self.clear_selection()
-            event.widget.config(bg="blue")
-            self.last_selected = event.widget.id
-            self.handler.get_values("selection").append(event.widget.id)
+        index = self.index_at(event)
+        if index is None:
+            return
+
+        selected = index in self.selection
+        self.clear_selection()
+        if not selected:
+            self.selection.add(index)
+            self.highlight(index)
+            self.last_selected = index
 
     def select_pages_control(self, event):
         """Selects multiple pages by holding control"""
-        if event.widget.id in self.handler.get_values("selection"):
-            event.widget.config(bg="#cecfd0")
-            self.handler.get_values("selection").remove(event.widget.id)
-        else:
-            event.widget.config(bg="blue")
-            self.last_selected = event.widget.id
+        index = self.index_at(event)
+        if index is None:
+            return
 
-            self.handler.get_values("selection").append(event.widget.id)
+        if self.selection.toggle(index):
+            self.last_selected = index
+        self.highlight(index, index in self.selection)
 
     def select_pages_shift(self, event):
         """Selection a range of pages by holding shift and right-clicking start and end"""
-        if self.last_selected < event.widget.id:
+        index = self.index_at(event)
+        if index is None:
+            return
+
+        if self.last_selected < index:
             start = self.last_selected
-            end = event.widget.id
+            end = index
         else:
-            start = event.widget.id
+            start = index
             end = self.last_selected
 
-        for widget in self.viewPort.winfo_children()[start : end + 1]:
-            widget.config(bg="blue")
-            if widget.id != self.last_selected:  # ensures no duplicates
-                self.handler.get_values("selection").append(widget.id)
+        # only pages which were not selected yet need to be repainted
+        self.repaint_selection(self.selection.add_range(start, end + 1))
 
     def clear_selection(self):
         """Removes all pages from selection"""
-        for widget in self.viewPort.winfo_children():
-            widget.config(bg="#cecfd0")
+        self.selection.clear()
+        self.clear_highlights()
+
+    def is_selected(self, index: int) -> bool:
+        """Checks if the page at index is selected"""
+        return index in self.selection
+
+    def mark_text(self, phrase: str, positions) -> None:
+        """Outlines the phrase on the pages at positions"""
+        if phrase != self.marked:
+            self._mark_rects.clear()
+        self.marked = phrase
+        self._marked_pages = set(positions)
+        self.draw_marks()
+
+    def draw_marks(self) -> None:
+        """Outlines the marked phrase on the pages in view"""
+        self.canvas.delete("mark")
+        if not self.marked or len(self.page_items) == 0:
+            return
+
+        scaling = self.scaling
+        for index in self.visible_range():
+            if index not in self._marked_pages:
+                continue
+
+            # pages are searched once per rotation, positions only scale
+            page = self.pages[index]
+            key = (page.number, page.rotation)
+            if key not in self._mark_rects:
+                with MUPDF_LOCK:
+                    self._mark_rects[key] = hit_rects(page, self.marked)
+
+            x, y, _, _ = self._slots[index]
+            zoom = self.page_zoom(page, scaling)
+            for rect in self._mark_rects[key]:
+                self.canvas.create_rectangle(
+                    x + rect.x0 * zoom,
+                    y + rect.y0 * zoom,
+                    x + rect.x1 * zoom,
+                    y + rect.y1 * zoom,
+                    outline=self.mark_color,
+                    width=2,
+                    tags=("page", "mark"),
+                )
 
-        self.handler.get_values("selection").clear()
+    def render_visible(self) -> None:
+        """Renders the pages in view and outlines the marked text on them"""
+        super().render_visible()
+        self.draw_marks()
 
     @property
     def scaling(self):
@@ -242,10 +457,143 @@ class PagesEditor(PageViewer):
 
     def jump_to_page(self, page: int) -> None:
         """Jumps with scrollbar to given page"""
-        if_overlap = 1 if len(self.page_label) % self.column != 0 else 0
-        self.canvas.yview_moveto(
-            str(
-                (page // self.column)
-                / (len(self.page_label) // self.column + if_overlap)
-            )
+        if page >= len(self._offsets):
+            return
+
+        self.canvas.yview_moveto(str(self._offsets[page] / self.layout_height))
+
+
+class SearchBar(tk.Frame):
+    """Entry searching the text of the document and jumping between the pages found
+
+    The text index is filled in the background, so while it grows the results
+    are looked up again and the first page found is jumped to as soon as there
+    is one.
+    """
+
+    def __init__(self, parent, event_handler, *args, **kwargs):
+        super().__init__(parent, *args, **kwargs)
+        self.handler = event_handler
+
+        self.query = tk.StringVar()
+        self.searched = ""  # query the results belong to
+        self.results: List[int] = []  # positions of the pages containing the query
+        self.current = -1  # index of the result jumped to
+
+        # results are updated while the document is being indexed
+        self.poll_interval = 250  # ms
+        self._poll_pending = None
+
+        self.entry = tk.Entry(master=self, textvariable=self.query, width=24)
+        self.entry.bind("<Return>", self._on_return)
+        self.entry.bind("<Escape>", lambda _: self.reset())
+        self.previousButton = tk.Button(
+            master=self, text="<", command=self.previous_result
         )
+        self.nextButton = tk.Button(master=self, text=">", command=self.next_result)
+        self.statusLabel = tk.Label(master=self, text="", width=24, anchor="w")
+
+        self.entry.pack(side="left", padx=2)
+        self.previousButton.pack(side="left")
+        self.nextButton.pack(side="left")
+        self.statusLabel.pack(side="left", padx=2)
+
+        self.handler.add_funcs("set-document", self.set_document)
+        # positions of the pages found change with every edit
+        self.handler.add_funcs("pages-changed", self.update_results)
+
+    def set_document(self) -> None:
+        """Searches the new document once it is being indexed"""
+        self.results = []
+        self.current = -1
+        self.update_results()
+        self._schedule_poll()
+
+    def _on_return(self, _event) -> None:
+        """Searches a new query or else jumps to the next result"""
+        if self.query.get() != self.searched:
+            self.search()
+        else:
+            self.next_result()
+
+    def search(self) -> None:
+        """Looks up the query and jumps to the first page found"""
+        self.searched = self.query.get()
+        self.current = -1
+        self.update_results()
+        self.next_result()
+        self._schedule_poll()
+
+    def reset(self) -> None:
+        """Clears the query and the marks on the pages"""
+        self.query.set("")
+        self.search()
+
+    def update_results(self, *_) -> None:
+        """Looks up the positions of the pages containing the searched query"""
+        indexer = self.handler.get_values("text-index")
+        numbers = set()
+        if indexer is not None and self.searched:
+            numbers = set(indexer.search(self.searched))
+
+        # keep the result jumped to when pages are found or moved
+        position = (
+            self.results[self.current] if 0 <= self.current < len(self.results) else -1
+        )
+
+        # only the pages of the edited document are indexed
+        pages = self.handler.get_values("pages")
+        self.results = [
+            index
+            for index, (number, source) in enumerate(zip(pages.numbers, pages.sources))
+            if source == 0 and number in numbers
+        ]
+        self.current = self.results.index(position) if position in self.results else -1
+
+        self.handler.call("mark-text", self.searched, self.results)
+        self.show_status()
+
+    def next_result(self) -> None:
+        """Jumps to the next page found"""
+        if self.results:
+            self.current = (self.current + 1) % len(self.results)
+            self.handler.call("jump-page", self.results[self.current])
+        self.show_status()
+
+    def previous_result(self) -> None:
+        """Jumps to the previous page found"""
+        if self.results:
+            self.current = (self.current - 1) % len(self.results)
+            self.handler.call("jump-page", self.results[self.current])
+        self.show_status()
+
+    def show_status(self) -> None:
+        """Shows the result jumped to and how far indexing got"""
+        if self.results:
+            text = f"{self.current + 1} of {len(self.results)}"
+        elif self.searched:
+            text = "not found"
+        else:
+            text = ""
+
+        indexer = self.handler.get_values("text-index")
+        if indexer is not None and not indexer.done:
+            text += f" (indexing {indexer.progress:.0%})"
+        self.statusLabel.configure(text=text)
+
+    def _schedule_poll(self) -> None:
+        """Checks the index again after the poll interval"""
+        if self._poll_pending is None:
+            self._poll_pending = self.after(self.poll_interval, self._poll)
+
+    def _poll(self) -> None:
+        """Updates the results with the pages indexed meanwhile"""
+        self._poll_pending = None
+        indexer = self.handler.get_values("text-index")
+
+        self.update_results()
+        if self.current == -1 and self.results:
+            self.next_result()  # the first page found arrived
+
+        if indexer is not None and not indexer.done:
+            self._schedule_poll()
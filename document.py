@@ -0,0 +1,534 @@
+import contextlib
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import BinaryIO, ContextManager, Iterator, List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+
+from pagemodel import PageModel
+
+__all__ = [
+    "SaveJob",
+    "OpenJob",
+    "LoadedDocument",
+    "OPEN_MODES",
+    "choose_save_mode",
+    "apply_pages",
+    "assemble_pages",
+    "merged_ranges",
+    "resident_memory",
+    "open_worker_document",
+    "worker_document",
+]
+
+# ways to open a document: read by MuPDF, memory mapped or read into memory
+OPEN_MODES = ("file", "mmap", "memory")
+
+
+def resident_memory() -> int:
+    """Gets the resident memory of this process in bytes or 0 if it is unknown"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+# document opened by each worker process of the render and text pools
+_worker_document: Optional[fitz.Document] = None
+
+
+def open_worker_document(path: str) -> None:
+    """Opens a private copy of the document in a worker process"""
+    global _worker_document  # skipcq: PYL-W0603
+    _worker_document = fitz.Document(path)
+
+
+def worker_document() -> fitz.Document:
+    """Gets the document opened by open_worker_document in this worker process"""
+    if _worker_document is None:
+        raise RuntimeError("The worker has not opened a document")
+    return _worker_document
+
+
+class LoadedDocument:
+    """Document opened from a file together with what it took to load it
+
+    Memory mapped documents are read from the page cache of the operating
+    system, which the kernel can reclaim, and in memory documents never touch
+    the file again. Either way the document keeps its path as name, so it is
+    saved and rendered by path like a document opened from the file. Closing
+    releases the document and the buffer it was read from. MuPDF is only
+    entered holding lock, the file is read without it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "file",
+        lock: Optional[ContextManager] = None,
+    ):
+        if mode not in OPEN_MODES:
+            raise ValueError(f"Mode must be one of: {', '.join(OPEN_MODES)}")
+        self.path = path
+        self.mode = mode
+        self._lock = lock if lock is not None else contextlib.nullcontext()
+
+        self._file: Optional[BinaryIO] = None
+        self._map: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+
+        before = resident_memory()
+        start = time.perf_counter()
+        self.document = self._open()
+        self.load_time = time.perf_counter() - start
+        self.memory = max(resident_memory() - before, 0)  # resident bytes added
+
+    def _open(self) -> fitz.Document:
+        """Opens the document the way of the mode"""
+        if self.mode == "memory":
+            with open(self.path, "rb") as file:
+                data = file.read()
+            with self._lock:
+                return fitz.Document(self.path, stream=data)
+
+        if self.mode == "mmap":
+            self._file = file = open(self.path, "rb")
+            try:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._map)
+                with self._lock:
+                    return fitz.Document(self.path, stream=self._view)
+            except (TypeError, ValueError):
+                # older PyMuPDF versions only read streams from bytes
+                self._release()
+                self.mode = "file"
+
+        with self._lock:
+            return fitz.Document(self.path)
+
+    @property
+    def closed(self) -> bool:
+        """Checks if the document was closed"""
+        return self.document.is_closed
+
+    def close(self) -> None:
+        """Closes the document and releases its buffer"""
+        if not self.document.is_closed:
+            self.document.close()
+        self._release()
+
+        # drop fonts and images MuPDF keeps decoded for the closed document
+        fitz.TOOLS.store_shrink(100)
+
+    def _release(self) -> None:
+        """Releases the memory map and the file"""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "LoadedDocument":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class OpenJob:
+    """Opens a document and reads the geometry of its pages on a background thread
+
+    The window stays responsive while a large file is read, e.g. from a slow
+    network mount. Pages are read in chunks, each holding lock, so other
+    documents keep rendering meanwhile. A cancelled job closes the document
+    once it is opened.
+    """
+
+    chunk_size = 256  # pages read at once holding the lock
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "file",
+        lock: Optional[ContextManager] = None,
+    ):
+        self.path = path
+        self.mode = mode
+        self.lock = lock if lock is not None else contextlib.nullcontext()
+        self.loaded: Optional[LoadedDocument] = None
+        self.pages: Optional[PageModel] = None
+        self.total = 0  # pages of the document, known once it is opened
+        self.read = 0  # pages whose geometry was read
+        self.error = ""
+
+        self._cancelled = threading.Event()
+        # taken to finish or to cancel, so exactly one of them closes a dropped document
+        self._finish_lock = threading.Lock()
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "OpenJob":
+        """Starts opening in the background"""
+        self._thread.start()
+        return self
+
+    @property
+    def done(self) -> bool:
+        """Checks if opening finished, failed or was cancelled"""
+        with self._finish_lock:
+            return self._finished
+
+    @property
+    def succeeded(self) -> bool:
+        """Checks if the document and its pages are ready"""
+        with self._finish_lock:
+            return (
+                self._finished
+                and self.pages is not None
+                and not self._cancelled.is_set()
+            )
+
+    @property
+    def progress(self) -> float:
+        """Gets the share of pages read"""
+        return self.read / self.total if self.total else 0.0
+
+    def cancel(self) -> None:
+        """Stops opening and closes the document, without waiting for the thread"""
+        with self._finish_lock:
+            self._cancelled.set()
+            if self._finished:
+                self._close()
+
+    def _close(self) -> None:
+        """Closes the document opened so far"""
+        if self.loaded is not None:
+            with self.lock:
+                self.loaded.close()
+
+    def _run(self) -> None:
+        """Main function of the background thread"""
+        try:
+            self.loaded = LoadedDocument(self.path, self.mode, self.lock)
+            document = self.loaded.document
+            self.total = len(document)
+
+            pages = PageModel(document)
+            for start in range(0, self.total, self.chunk_size):
+                if self._cancelled.is_set():
+                    break
+                with self.lock:
+                    pages.read(
+                        document, range(start, min(start + self.chunk_size, self.total))
+                    )
+                self.read = len(pages)
+            else:
+                self.pages = pages
+        except Exception as error:  # skipcq: PYL-W0703
+            self.error = str(error) or type(error).__name__
+
+        with self._finish_lock:
+            self._finished = True
+            if self._cancelled.is_set() or self.error:
+                self._close()
+
+
+def choose_save_mode(source: str, target: str, order: Sequence[int], pages: int) -> str:
+    """Chooses how to save pages of source in the given order to target
+
+    Reordering pages of a file in place only changes its page tree, which an
+    incremental save appends to the end of the file. Saving to another file or
+    dropping pages calls for a full rewrite collecting the unused objects.
+    """
+    same_file = os.path.exists(target) and os.path.samefile(source, target)
+    if same_file and sorted(order) == list(range(pages)):
+        return "incremental"
+    return "full"
+
+
+def apply_pages(
+    doc: fitz.Document, order: Sequence[int], rotations: Sequence[int] = ()
+) -> None:
+    """Brings the pages of the document into order with one select and sets their rotations"""
+    if list(order) != list(range(len(doc))):
+        doc.select(list(order))
+    for page, rotation in zip(doc, rotations):
+        if page.rotation != rotation:
+            page.set_rotation(rotation)
+
+
+def merged_ranges(
+    order: Sequence[int], origins: Sequence[int]
+) -> Iterator[Tuple[int, int, int]]:
+    """Yields origin, first and last page of each run of consecutive pages of one document"""
+    start = 0
+    for i in range(1, len(order) + 1):
+        if (
+            i == len(order)
+            or origins[i] != origins[i - 1]
+            or order[i] != order[i - 1] + 1
+        ):
+            yield origins[start], order[start], order[i - 1]
+            start = i
+
+
+def assemble_pages(
+    documents: Sequence[fitz.Document],
+    order: Sequence[int],
+    origins: Sequence[int],
+    rotations: Sequence[int] = (),
+) -> fitz.Document:
+    """Collects the pages of several documents into a new one with their rotations
+
+    Consecutive pages of a document are copied with one insert_pdf each.
+    """
+    doc = fitz.Document()
+    for origin, first, last in merged_ranges(order, origins):
+        doc.insert_pdf(documents[origin], from_page=first, to_page=last)
+    for page, rotation in zip(doc, rotations):
+        if page.rotation != rotation:
+            page.set_rotation(rotation)
+    return doc
+
+
+def _save(
+    source: str,
+    target: str,
+    order: Sequence[int],
+    rotations: Sequence[int],
+    mode: str,
+    messages,
+    documents: Sequence[str] = (),
+    origins: Sequence[int] = (),
+) -> None:
+    """Applies the page order and rotations to source and saves it to target in a worker process
+
+    With documents the pages are collected from the documents at these paths.
+    The mode is chosen here, so the source is only opened by the worker, and
+    sent back together with the number of pages before writing starts. A target
+    which cannot be replaced while another process keeps it open is left to the
+    job to replace.
+    """
+    sources: List[fitz.Document] = []
+    try:
+        if documents:
+            sources = [fitz.Document(path) for path in documents]
+            messages.send(("mode", "full", len(order)))
+            doc = assemble_pages(sources, order, origins, rotations)
+        else:
+            doc = fitz.Document(source)
+            if mode == "auto":
+                mode = choose_save_mode(source, target, order, len(doc))
+            if mode == "incremental" and not doc.can_save_incrementally():
+                mode = "full"
+            messages.send(("mode", mode, len(doc)))
+            apply_pages(doc, order, rotations)
+
+        if mode == "incremental":
+            doc.save(source, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+            doc.close()
+        else:
+            # write next to the target to not leave a broken file when cancelled
+            doc.save(target + ".part", garbage=3, deflate=True)
+            doc.close()
+            for opened in sources:  # the target may be one of them
+                opened.close()
+            try:
+                os.replace(target + ".part", target)
+            except PermissionError:
+                # Windows does not replace a file the editor still has open
+                messages.send(("replace", target))
+    except Exception as error:  # skipcq: PYL-W0703
+        messages.send(("error", str(error)))
+
+
+class SaveJob:
+    """Saves a reordered document in a worker process
+
+    The worker opens the source file itself, so the user interface keeps
+    running while large documents are opened and written. The mode is "auto"
+    until the worker has chosen it. Progress is estimated from the growth of
+    the written file and a cancelled save leaves target untouched.
+    All page edits are applied at once by selecting the order and setting the
+    rotations of the pages. Pages of other documents, given by the index of
+    their path in documents, are collected into a new file with insert_pdf.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        target: str,
+        order: Sequence[int],
+        mode: str = "auto",
+        rotations: Optional[Sequence[int]] = None,
+        documents: Optional[Sequence[str]] = None,
+        origins: Optional[Sequence[int]] = None,
+    ):
+        if mode not in ("auto", "incremental", "full"):
+            raise ValueError("Mode must be 'auto', 'incremental' or 'full'")
+        self.source = source
+        self.target = target
+        self.order = list(order)
+        self.rotations = list(rotations) if rotations is not None else []
+        self.mode = mode
+
+        # paths of the documents the pages come from, only needed for other ones
+        self.documents = list(documents) if documents is not None else [source]
+        self.origins = list(origins) if origins is not None else [0] * len(order)
+        if self.documents[:1] == [source] and not any(self.origins):
+            self.documents, self.origins = [], []
+
+        # expected number of bytes to write to estimate the progress, known with the mode
+        self._source_size = os.path.getsize(source)
+        self._start_size = 0
+        self._expected = 1
+
+        self.error = ""
+        self.cancelled = False
+        # the target was written but is still to be replaced, see finish
+        self.replace_pending = False
+        self._process: Optional[multiprocessing.process.BaseProcess] = None
+        self._messages: Optional[Connection] = None
+
+    def start(self) -> "SaveJob":
+        """Starts the worker process"""
+        # forking a process running threads is unsafe
+        context = multiprocessing.get_context("spawn")
+        self._messages, sender = context.Pipe(duplex=False)
+        self._process = context.Process(
+            target=_save,
+            args=(
+                self.source,
+                self.target,
+                self.order,
+                self.rotations,
+                self.mode,
+                sender,
+                self.documents,
+                self.origins,
+            ),
+            daemon=True,
+        )
+        self._process.start()
+
+        # only the worker writes to the pipe
+        sender.close()
+        return self
+
+    def _receive(self) -> None:
+        """Reads the mode and errors sent by the worker so far"""
+        messages = self._messages
+        while messages is not None and messages.poll():
+            try:
+                message = messages.recv()
+            except EOFError:
+                break
+            if message[0] == "mode":
+                self._set_mode(message[1], message[2])
+            elif message[0] == "replace":
+                self.replace_pending = True
+            else:
+                self.error = message[1]
+
+    def _set_mode(self, mode: str, pages: int) -> None:
+        """Takes over the mode chosen by the worker and estimates the bytes to write"""
+        self.mode = mode
+        if mode == "incremental":
+            self._start_size = self._source_size
+            self._expected = 4096 + 64 * len(self.order)
+        elif self.documents:
+            self._expected = max(
+                sum(os.path.getsize(path) for path in set(self.documents)), 1
+            )
+        else:
+            self._expected = max(
+                self._source_size * len(self.order) // max(pages, 1), 1
+            )
+
+    @property
+    def written(self) -> str:
+        """Gets the path of the file being written"""
+        return self.source if self.mode == "incremental" else self.target + ".part"
+
+    @property
+    def done(self) -> bool:
+        """Checks if the worker finished, failed or was cancelled"""
+        if self._process is None or self._process.is_alive():
+            return False
+
+        if self._messages is not None:
+            self._receive()
+            if not self.error and self._process.exitcode and not self.cancelled:
+                self.error = f"Saving stopped with exit code {self._process.exitcode}"
+            self._messages.close()
+            self._messages = None
+        return True
+
+    @property
+    def succeeded(self) -> bool:
+        """Checks if the document was saved"""
+        return (
+            self.done
+            and not self.error
+            and not self.cancelled
+            and not self.replace_pending
+        )
+
+    def finish(self) -> None:
+        """Replaces the target with the written file once no process keeps it open
+
+        Raises OSError if it still cannot be replaced. The written file is kept
+        then, so the saved pages are not lost.
+        """
+        if self.replace_pending:
+            os.replace(self.written, self.target)
+            self.replace_pending = False
+
+    @property
+    def progress(self) -> float:
+        """Gets the estimated share of the document written"""
+        if self.done:
+            return 1.0
+        self._receive()
+        if self.mode == "auto":
+            return 0.0  # the worker is still opening the source
+        try:
+            written = os.path.getsize(self.written) - self._start_size
+        except OSError:
+            written = 0
+        return min(max(written / self._expected, 0.0), 0.99)
+
+    def wait(self) -> bool:
+        """Blocks until the worker finished and returns whether the document was saved"""
+        if self._process is not None:
+            self._process.join()
+        return self.succeeded
+
+    def cancel(self) -> None:
+        """Stops the worker and removes everything it wrote"""
+        if self._process is None or not self._process.is_alive():
+            return
+
+        self._process.terminate()
+        self._process.join()
+        if self._process.exitcode == 0:
+            return  # finished before it could be stopped
+        self.cancelled = True
+
+        # the mode is sent before anything is written
+        self._receive()
+        if self.mode == "incremental":
+            # an incremental save only appends, so cut the file to its former size
+            with open(self.source, "r+b") as file:
+                file.truncate(self._start_size)
+        elif self.mode == "full" and os.path.exists(self.written):
+            os.remove(self.written)
@@ -0,0 +1,210 @@
+import array
+from typing import List, Optional, Sequence
+
+import fitz  # PyMuPDF
+
+from pagemodel import PageModel
+
+__all__ = ["PageDelta", "Command", "History"]
+
+
+class PageDelta:
+    """Change of the page sequence holding only the affected positions and pages
+
+    A delta either removes the pages at positions, inserts pages so they end up
+    at positions, or rotates the pages at positions by an angle.
+    """
+
+    __slots__ = ("kind", "positions", "pages", "angle")
+
+    def __init__(
+        self,
+        kind: str,
+        positions: Sequence[int],
+        pages: Optional[PageModel] = None,
+        angle: int = 0,
+    ):
+        if kind not in ("remove", "insert", "rotate"):
+            raise ValueError("Kind must be 'remove', 'insert' or 'rotate'")
+
+        self.kind = kind
+        self.positions = array.array("i", sorted(positions))
+        self.pages = pages
+        self.angle = angle
+
+    def apply(self, model: PageModel) -> None:
+        """Applies the change to the model"""
+        if self.kind == "remove":
+            # remember the removed pages to be able to insert them again
+            self.pages = model.remove(self.positions)
+        elif self.kind == "insert":
+            if self.pages is None:
+                raise ValueError("Pages to insert are missing")
+            model.insert(self.positions, self.pages)
+        else:
+            model.rotate(self.positions, self.angle)
+
+    def inverse(self) -> "PageDelta":
+        """Gets the delta reverting this one"""
+        if self.kind == "remove":
+            return PageDelta("insert", self.positions, self.pages)
+        if self.kind == "insert":
+            return PageDelta("remove", self.positions)
+        return PageDelta("rotate", self.positions, angle=-self.angle)
+
+    @property
+    def first(self) -> int:
+        """Gets the first position changed by the delta"""
+        return self.positions[0] if self.positions else 0
+
+
+class Command:
+    """Named page operation made of deltas"""
+
+    __slots__ = ("name", "deltas")
+
+    def __init__(self, name: str, deltas: List[PageDelta]):
+        self.name = name
+        self.deltas = deltas
+
+    @classmethod
+    def delete(cls, positions: Sequence[int], name: str = "delete") -> "Command":
+        """Creates a command removing the pages at positions"""
+        return cls(name, [PageDelta("remove", positions)])
+
+    @classmethod
+    def insert(cls, position: int, pages: PageModel, name: str = "paste") -> "Command":
+        """Creates a command inserting pages in front of position"""
+        return cls(
+            name, [PageDelta("insert", range(position, position + len(pages)), pages)]
+        )
+
+    @classmethod
+    def move(cls, positions: Sequence[int], position: int) -> "Command":
+        """Creates a command moving the pages at positions in front of position
+
+        The target position counts the pages without the moved ones.
+        """
+        remove = PageDelta("remove", positions)
+        insert = PageDelta("insert", range(position, position + len(positions)))
+        return cls("move", [remove, insert])
+
+    @classmethod
+    def rotate(cls, positions: Sequence[int], angle: int) -> "Command":
+        """Creates a command rotating the pages at positions clockwise"""
+        return cls("rotate", [PageDelta("rotate", positions, angle=angle)])
+
+    def apply(self, model: PageModel) -> None:
+        """Applies all deltas to the model"""
+        for i, delta in enumerate(self.deltas):
+            # a move inserts the pages it removed just before
+            if delta.kind == "insert" and delta.pages is None:
+                delta.pages = self.deltas[i - 1].pages
+            delta.apply(model)
+
+    def inverse(self) -> "Command":
+        """Gets the command reverting this one"""
+        return Command(self.name, [delta.inverse() for delta in reversed(self.deltas)])
+
+    @property
+    def structural(self) -> bool:
+        """Checks if pages are added, removed or moved"""
+        return any(delta.kind != "rotate" for delta in self.deltas)
+
+    @property
+    def shift(self) -> int:
+        """Gets by how many pages the pages following the change are shifted"""
+        shift = 0
+        for delta in self.deltas:
+            if delta.kind == "insert":
+                shift += len(delta.positions)
+            elif delta.kind == "remove":
+                shift -= len(delta.positions)
+        return shift
+
+    @property
+    def first(self) -> int:
+        """Gets the first position changed by the command"""
+        return min(delta.first for delta in self.deltas)
+
+    @property
+    def positions(self) -> List[int]:
+        """Gets all positions changed by the command"""
+        return sorted({p for delta in self.deltas for p in delta.positions})
+
+    @property
+    def last(self) -> Optional[int]:
+        """Gets the position after the last changed page or None if all following pages shifted"""
+        if self.shift:
+            return None
+        return self.positions[-1] + 1 if self.deltas else 0
+
+
+class History:
+    """Undo and redo stacks of the commands applied to a page model
+
+    Commands store the changed positions and pages only, so the memory and time
+    of an undo or redo grow with the size of the change, not of the document.
+    """
+
+    def __init__(self, model: PageModel, limit: int = 200):
+        self.model = model
+        self.limit = limit  # number of commands which can be undone
+        self._undo: List[Command] = []
+        self._redo: List[Command] = []
+
+    @property
+    def can_undo(self) -> bool:
+        """Checks if a command can be undone"""
+        return len(self._undo) > 0
+
+    @property
+    def can_redo(self) -> bool:
+        """Checks if an undone command can be redone"""
+        return len(self._redo) > 0
+
+    def execute(self, command: Command) -> Command:
+        """Applies a command and records it"""
+        command.apply(self.model)
+
+        self._undo.append(command)
+        if len(self._undo) > self.limit:
+            del self._undo[0]
+        self._redo.clear()
+        return command
+
+    def undo(self) -> Optional[Command]:
+        """Reverts the last command and returns the command applied to do so"""
+        if not self.can_undo:
+            return None
+
+        command = self._undo.pop()
+        self._redo.append(command)
+
+        inverse = command.inverse()
+        inverse.apply(self.model)
+        return inverse
+
+    def redo(self) -> Optional[Command]:
+        """Applies the last undone command again"""
+        if not self.can_redo:
+            return None
+
+        command = self._redo.pop()
+        self._undo.append(command)
+
+        command.apply(self.model)
+        return command
+
+    def uses(self, document: fitz.Document) -> bool:
+        """Checks if a recorded command holds pages of document"""
+        return any(
+            delta.pages is not None and delta.pages.uses(document)
+            for command in self._undo + self._redo
+            for delta in command.deltas
+        )
+
+    def clear(self) -> None:
+        """Forgets all recorded commands"""
+        self._undo.clear()
+        self._redo.clear()
@@ -0,0 +1,199 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+__all__ = ["Metrics", "METRICS"]
+
+
+class _NullSpan:
+    """Span doing nothing, handed out while recording is disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+
+class _Span:
+    """Measures the time spent in a with-block"""
+
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.metrics.add_span(self.name, self.start, time.perf_counter())
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """Timing spans, counters and gauges of the hot paths
+
+    While disabled, spans are a shared object doing nothing and counters return
+    after checking a flag, so instrumented code runs at nearly full speed.
+    Durations are kept per span name for percentiles and as trace events which
+    can be loaded into chrome://tracing or Perfetto.
+    """
+
+    def __init__(
+        self, enabled: bool = False, samples: int = 10000, events: int = 100000
+    ):
+        self.enabled = enabled
+        self.samples = samples  # durations kept per span name
+        self.events = events  # trace events kept in total
+
+        self._durations: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=self.samples)
+        )
+        self._totals: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        self._trace: Deque[Tuple[str, float, float, int]] = deque(maxlen=self.events)
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()  # spans end on the render threads too
+
+    def span(self, name: str, detail: str = ""):
+        """Gets a context manager timing its block under name"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, f"{name}:{detail}" if detail else name)
+
+    def timed(self, name: str) -> Callable:
+        """Decorator timing every call of a function under name"""
+
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Span(self, name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def add_span(self, name: str, start: float, end: float) -> None:
+        """Records a finished span"""
+        duration = end - start
+        with self._lock:
+            self._durations[name].append(duration)
+            total = self._totals[name]
+            total[0] += 1
+            total[1] += duration
+            self._trace.append((name, start, duration, threading.get_ident()))
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Increases a counter"""
+        if self.enabled:
+            with self._lock:
+                self._counters[name] += value
+
+    def gauge(self, name: str, function: Callable[[], Any]) -> None:
+        """Registers a function read whenever a summary is taken"""
+        self._gauges[name] = function
+
+    def reset(self) -> None:
+        """Forgets everything recorded"""
+        with self._lock:
+            self._durations.clear()
+            self._totals.clear()
+            self._trace.clear()
+            self._counters.clear()
+            self._origin = time.perf_counter()
+
+    @staticmethod
+    def percentile(values: List[float], share: float) -> float:
+        """Gets the value below which the given share of the sorted values lie"""
+        if not values:
+            return 0.0
+        return values[min(int(share * len(values)), len(values) - 1)]
+
+    def summary(self) -> Dict[str, Any]:
+        """Gets the counters, gauges and the statistics of every span"""
+        with self._lock:
+            spans = {}
+            for name, durations in self._durations.items():
+                values = sorted(durations)
+                count, total = self._totals[name]
+                spans[name] = {
+                    "count": count,
+                    "total": total,
+                    "mean": total / count,
+                    "p50": self.percentile(values, 0.5),
+                    "p90": self.percentile(values, 0.9),
+                    "p99": self.percentile(values, 0.99),
+                    "max": values[-1],
+                }
+            counters = dict(self._counters)
+
+        gauges = {}
+        for name, function in self._gauges.items():
+            try:
+                gauges[name] = function()
+            except Exception as error:  # skipcq: PYL-W0703
+                gauges[name] = str(error)
+        return {"spans": spans, "counters": counters, "gauges": gauges}
+
+    def report(self) -> str:
+        """Formats the summary as a table"""
+        summary = self.summary()
+        lines = [
+            f"{'span':<32}{'count':>8}{'total':>10}{'p50':>10}{'p90':>10}{'p99':>10}"
+        ]
+        for name, stats in sorted(summary["spans"].items()):
+            lines.append(
+                f"{name:<32}{stats['count']:>8}{stats['total']:>9.3f}s"
+                + "".join(
+                    f"{stats[key] * 1000:>8.2f}ms" for key in ("p50", "p90", "p99")
+                )
+            )
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"{name:<32}{value:>8}")
+        for name, value in sorted(summary["gauges"].items()):
+            lines.append(f"{name:<32}{value}")
+        return "\n".join(lines)
+
+    def dump(self, path: str) -> None:
+        """Writes the summary to a JSON file"""
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def dump_trace(self, path: str) -> None:
+        """Writes the recorded spans as trace events"""
+        pid = os.getpid()
+        with self._lock:
+            events = [
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self._origin) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": pid,
+                    "tid": tid,
+                }
+                for name, start, duration, tid in self._trace
+            ]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+# metrics of the whole application
+METRICS = Metrics()
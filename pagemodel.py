@@ -0,0 +1,210 @@
+import array
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+
+__all__ = ["PageRef", "PageModel", "runs"]
+
+
+def runs(positions: Sequence[int]) -> Iterator[Tuple[int, int]]:
+    """Yields start and stop of the consecutive runs in sorted positions"""
+    start = 0
+    for i in range(1, len(positions) + 1):
+        if i == len(positions) or positions[i] != positions[i - 1] + 1:
+            yield positions[start], positions[i - 1] + 1
+            start = i
+
+
+class PageRef:
+    """Lightweight reference to a page which loads it from the document only to render
+
+    Offers the attributes of a fitz.Page the renderers rely on, so it can be
+    used in place of one.
+    """
+
+    __slots__ = ("parent", "number", "width", "height", "rotation")
+
+    def __init__(
+        self,
+        parent: fitz.Document,
+        number: int,
+        width: float,
+        height: float,
+        rotation: int = 0,
+    ):
+        self.parent = parent
+        self.number = number
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+
+    def __repr__(self) -> str:
+        return f"PageRef({self.number}, {self.width}x{self.height}, {self.rotation})"
+
+    @property
+    def rect(self) -> fitz.Rect:
+        """Gets the rect of the page as displayed"""
+        return fitz.Rect(0, 0, self.width, self.height)
+
+    def load(self) -> fitz.Page:
+        """Loads the page from the document"""
+        return self.parent.load_page(self.number)
+
+    def get_pixmap(self, matrix=fitz.Identity, **kwargs) -> fitz.Pixmap:
+        """Loads and renders the page turned by the rotation of the reference"""
+        page = self.load()
+        if self.rotation != page.rotation:
+            matrix = fitz.Matrix(matrix).prerotate(self.rotation - page.rotation)
+        return page.get_pixmap(matrix=matrix, **kwargs)
+
+
+class PageModel:
+    """Array backed columns describing pages of one or more documents
+
+    Only the page number, size and rotation of each page are held, so memory
+    stays flat no matter how many pages the document has. Editing pages only
+    changes the model, the document stays as it was opened until it is saved.
+    Pages of other documents refer to them by their index in documents.
+    """
+
+    def __init__(self, document: Optional[fitz.Document] = None):
+        self.documents: List[fitz.Document] = [] if document is None else [document]
+        self.numbers = array.array("i")
+        self.sources = array.array("H")  # index of the document of each page
+        self.widths = array.array("f")
+        self.heights = array.array("f")
+        self.rotations = array.array("h")
+
+    @classmethod
+    def from_document(cls, document: fitz.Document) -> "PageModel":
+        """Reads the geometry of all pages of a document"""
+        model = cls(document)
+        model.read(document, range(len(document)))
+        return model
+
+    def read(self, document: fitz.Document, numbers: Iterable[int]) -> None:
+        """Appends the geometry of the pages with the given numbers of the model's document"""
+        for number in numbers:
+            page = document[number]  # pages are only loaded to read their geometry
+            rect = page.rect
+            self.append(number, rect.width, rect.height, page.rotation)
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def __getitem__(self, index: int) -> PageRef:
+        return PageRef(
+            self.documents[self.sources[index]],
+            self.numbers[index],
+            self.widths[index],
+            self.heights[index],
+            self.rotations[index],
+        )
+
+    def __iter__(self) -> Iterator[PageRef]:
+        return (self[index] for index in range(len(self)))
+
+    @property
+    def document(self) -> Optional[fitz.Document]:
+        """Gets the document the model was created from"""
+        return self.documents[0] if self.documents else None
+
+    @property
+    def columns(self) -> List[array.array]:
+        """Gets the arrays holding the pages"""
+        return [self.numbers, self.sources, self.widths, self.heights, self.rotations]
+
+    def uses(self, document: fitz.Document) -> bool:
+        """Checks if any page of the model belongs to document"""
+        return any(self.documents[source] is document for source in set(self.sources))
+
+    def append(
+        self,
+        number: int,
+        width: float,
+        height: float,
+        rotation: int = 0,
+        source: int = 0,
+    ) -> None:
+        """Adds a page of the document at index source to the end of the model"""
+        self.numbers.append(number)
+        self.sources.append(source)
+        self.widths.append(width)
+        self.heights.append(height)
+        self.rotations.append(rotation)
+
+    def subset(self, indices: Iterable[int]) -> "PageModel":
+        """Creates a model of the pages at the given indices"""
+        model = PageModel()
+        model.documents = self.documents[:]
+        for index in indices:
+            model.append(
+                self.numbers[index],
+                self.widths[index],
+                self.heights[index],
+                self.rotations[index],
+                self.sources[index],
+            )
+        return model
+
+    def extend(self, model: "PageModel") -> None:
+        """Adds the pages of another model"""
+        for column, other in zip(self.columns, self._adopt(model)):
+            column.extend(other)
+
+    def remove(self, positions: Sequence[int]) -> "PageModel":
+        """Removes the pages at the sorted positions and returns them"""
+        removed = self.subset(positions)
+
+        # delete from the back to keep the positions in front valid
+        for start, stop in reversed(list(runs(positions))):
+            for column in self.columns:
+                del column[start:stop]
+        return removed
+
+    def insert(self, positions: Sequence[int], model: "PageModel") -> None:
+        """Inserts the pages of model so they end up at the sorted positions"""
+        others = self._adopt(model)
+
+        offset = 0
+        for start, stop in runs(positions):
+            count = stop - start
+            for column, other in zip(self.columns, others):
+                column[start:start] = other[offset : offset + count]
+            offset += count
+
+    def rotate(self, positions: Sequence[int], angle: int) -> None:
+        """Turns the pages at the given positions clockwise by a multiple of 90 degrees"""
+        for position in positions:
+            self.rotations[position] = (self.rotations[position] + angle) % 360
+            if angle % 180:
+                self.widths[position], self.heights[position] = (
+                    self.heights[position],
+                    self.widths[position],
+                )
+
+    def clear(self) -> None:
+        """Removes all pages"""
+        for column in self.columns:
+            del column[:]
+
+    def _adopt(self, model: "PageModel") -> List[array.array]:
+        """Takes over the documents of model and gets its columns with sources of this model"""
+        if len(self) == 0 and len(self.documents) > 1:
+            # forget the documents of pages which are gone
+            del self.documents[1:]
+
+        mapping = []
+        for document in model.documents:
+            for index, own in enumerate(self.documents):
+                if own is document:
+                    mapping.append(index)
+                    break
+            else:
+                self.documents.append(document)
+                mapping.append(len(self.documents) - 1)
+
+        sources = model.sources
+        if mapping != list(range(len(mapping))):
+            sources = array.array("H", (mapping[source] for source in sources))
+        return [model.numbers, sources, model.widths, model.heights, model.rotations]
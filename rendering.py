@@ -0,0 +1,647 @@
+import concurrent.futures
+import io
+import multiprocessing
+import os
+import queue
+import threading
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Hashable, Iterator, List, Optional, Sequence, Tuple, cast
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from document import open_worker_document, worker_document
+from metrics import METRICS
+from pagemodel import PageRef
+from thumbnails import ThumbnailStore
+
+__all__ = [
+    "MUPDF_LOCK",
+    "DRAFT_AA_LEVEL",
+    "fit_zoom",
+    "PageImage",
+    "render_page",
+    "render_tile",
+    "RenderCache",
+    "RenderBackend",
+    "ThreadBackend",
+    "ProcessBackend",
+    "BACKENDS",
+    "make_backend",
+    "PageLoader",
+]
+
+# MuPDF must not be entered by two threads at once on the same document
+MUPDF_LOCK = threading.RLock()
+
+# anti-aliasing of draft renders, from 0 (none) to 8 (full quality)
+DRAFT_AA_LEVEL = 2
+
+
+def fit_zoom(rect: fitz.Rect, width: float = 0, height: float = 0) -> float:
+    """Calculates the zoom factor needed to fit the given page rect into width or height"""
+    if height:
+        return height / rect.height
+    return width / rect.width
+
+
+class PageImage:
+    """Rendered page held as a binary PPM or PGM image
+
+    Tk reads these formats directly, so a page written by MuPDF reaches the
+    screen with one copy into the PhotoImage instead of being unpacked and
+    converted by PIL first. PIL is only needed to resample an image.
+    """
+
+    __slots__ = ("width", "height", "data")
+
+    def __init__(self, width: int, height: int, data: bytes):
+        self.width = width
+        self.height = height
+        self.data = data  # the whole PNM file, header and pixels
+
+    def __repr__(self) -> str:
+        return f"PageImage({self.width}x{self.height}, {len(self.data)} bytes)"
+
+    @staticmethod
+    def header(width: int, height: int, channels: int = 3) -> bytes:
+        """Gets the PNM header of an image with 1 (gray) or 3 (RGB) channels"""
+        return b"P%d\n%d %d\n255\n" % (5 if channels == 1 else 6, width, height)
+
+    @classmethod
+    def from_pixmap(cls, pix: fitz.Pixmap) -> "PageImage":
+        """Copies the pixels of a pixmap once into a PNM image"""
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)  # PNM has no alpha channel
+        return cls(pix.width, pix.height, pix.tobytes("pnm"))
+
+    @classmethod
+    def from_image(cls, img: Image.Image) -> "PageImage":
+        """Encodes a PIL image, e.g. a resampled or stored one"""
+        if img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, "PPM")
+        return cls(img.width, img.height, buffer.getvalue())
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Gets the width and height in pixels"""
+        return self.width, self.height
+
+    @property
+    def nbytes(self) -> int:
+        """Gets the number of bytes held"""
+        return len(self.data)
+
+    def image(self) -> Image.Image:
+        """Decodes the image with PIL to resample or store it"""
+        with Image.open(io.BytesIO(self.data)) as img:
+            img.load()
+        return img
+
+
+def _separate_aa_levels() -> bool:
+    """Checks if the anti-aliasing of graphics and text can be set apart
+
+    Older PyMuPDF versions only set both levels to the same value at once.
+    """
+    return hasattr(getattr(fitz, "mupdf", None), "fz_set_text_aa_level")
+
+
+def _set_aa_levels(graphics: int, text: int) -> None:
+    """Sets the anti-aliasing levels of graphics and text"""
+    if _separate_aa_levels():
+        fitz.mupdf.fz_set_graphics_aa_level(graphics)
+        fitz.mupdf.fz_set_text_aa_level(text)
+    else:
+        fitz.TOOLS.set_aa_level(graphics)
+
+
+def render_page(
+    page: fitz.Page, zoom: float, draft: bool = False, gray: bool = False
+) -> PageImage:
+    """Rasterizes a page once at its final size and returns it as a PageImage
+
+    Drafts are rendered with less anti-aliasing and without annotations, and
+    optionally in grayscale, to be shown while the final render is pending.
+    """
+    with METRICS.span("render.draft" if draft else "render.page"):
+        with MUPDF_LOCK:
+            if not draft:
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            else:
+                # the levels are global, the lock keeps other renders from seeing them
+                levels = fitz.TOOLS.show_aa_level()
+                graphics, text = levels["graphics"], levels["text"]
+                # levels which could not be restored are left as they are
+                lowered = graphics == text or _separate_aa_levels()
+                if lowered:
+                    _set_aa_levels(DRAFT_AA_LEVEL, DRAFT_AA_LEVEL)
+                try:
+                    pix = page.get_pixmap(
+                        matrix=fitz.Matrix(zoom, zoom),
+                        colorspace=fitz.csGRAY if gray else fitz.csRGB,
+                        annots=False,
+                    )
+                finally:
+                    if lowered:
+                        _set_aa_levels(graphics, text)
+
+            # converting the pixmap calls into MuPDF as well
+            return PageImage.from_pixmap(pix)
+
+
+def render_tile(
+    page: fitz.Page, zoom: float, box: Tuple[int, int, int, int]
+) -> PageImage:
+    """Rasterizes the box (x0, y0, x1, y1) of a page rendered with zoom, in pixels"""
+    with METRICS.span("render.tile"):
+        with MUPDF_LOCK:
+            matrix = fitz.Matrix(zoom, zoom)
+            if isinstance(page, PageRef):
+                # turn the loaded page like the reference does
+                ref, page = page, page.load()
+                matrix.prerotate(ref.rotation - page.rotation)
+
+            # the clip is given in page coordinates, the rendered page starts
+            # at the corner of its bounds
+            bounds = page.rect * matrix
+            clip = fitz.Rect(box) + (bounds.x0, bounds.y0, bounds.x0, bounds.y0)
+            pix = page.get_pixmap(matrix=matrix, clip=clip * ~matrix)
+            return PageImage.from_pixmap(pix)
+
+
+class RenderCache:
+    """Memory bounded least recently used cache of rendered pages shared by all viewers"""
+
+    def __init__(
+        self, budget: int = 256 * 1024**2, store: Optional[ThumbnailStore] = None
+    ):
+        self.budget = budget  # maximum number of bytes held by cached images
+        self.store = store  # keeps thumbnails on disk between sessions
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._images: "OrderedDict[Hashable, PageImage]" = OrderedDict()
+        # the viewers render from worker threads
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._images
+
+    @staticmethod
+    def key(page: fitz.Page, zoom: float) -> Tuple[int, int, float, int]:
+        """Gets the key of a page rendered with the given zoom"""
+        return id(page.parent), page.number, round(zoom, 4), page.rotation
+
+    @property
+    def hit_rate(self) -> float:
+        """Gets the share of lookups answered from the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: Hashable) -> Optional[PageImage]:
+        """Gets a cached image and marks it as recently used"""
+        with self._lock:
+            img = self._images.get(key)
+            if img is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._images.move_to_end(key)
+            return img
+
+    def put(self, key: Hashable, img: PageImage) -> None:
+        """Stores an image and evicts the least recently used ones above the budget"""
+        nbytes = self._nbytes(img)
+        if nbytes > self.budget:
+            return
+
+        with self._lock:
+            if key in self._images:
+                self.size -= self._nbytes(self._images.pop(key))
+            self._images[key] = img
+            self.size += nbytes
+
+            while self.size > self.budget:
+                _, evicted = self._images.popitem(last=False)
+                self.size -= self._nbytes(evicted)
+
+    def render(self, page: fitz.Page, zoom: float) -> PageImage:
+        """Gets the rendered page from the cache or renders and stores it"""
+        with MUPDF_LOCK:
+            key = self.key(page, zoom)
+        img = self.get(key)
+        if img is None:
+            img = render_page(page, zoom)
+            METRICS.count("render.pages")
+            self.put(key, img)
+        return img
+
+    def render_tile(
+        self, page: fitz.Page, zoom: float, box: Tuple[int, int, int, int]
+    ) -> PageImage:
+        """Gets a rendered tile of a page from the cache or renders and stores it"""
+        with MUPDF_LOCK:
+            key = self.key(page, zoom) + (box,)
+        img = self.get(key)
+        if img is None:
+            img = render_tile(page, zoom, box)
+            METRICS.count("render.tiles")
+            self.put(key, img)
+        return img
+
+    def render_pages(
+        self,
+        pages: Sequence[fitz.Page],
+        zooms: Sequence[float],
+        backend: Optional["RenderBackend"] = None,
+    ) -> List[PageImage]:
+        """Gets the rendered pages from the cache and renders the missing ones in one batch"""
+        with MUPDF_LOCK:
+            keys = [self.key(page, zoom) for page, zoom in zip(pages, zooms)]
+        imgs = [self.get(key) for key in keys]
+
+        missing = [index for index, img in enumerate(imgs) if img is None]
+
+        # thumbnails may be stored on disk from a former session
+        paths = {}
+        for index in missing:
+            path = self.stored_path(pages[index], zooms[index])
+            if path and self.store is not None:
+                paths[index] = path
+                stored = self.store.load(path)
+                if stored is not None:
+                    img = PageImage.from_image(stored)
+                    imgs[index] = img
+                    self.put(keys[index], img)
+        METRICS.count("render.stored", len(paths))
+        missing = [index for index in missing if imgs[index] is None]
+        METRICS.count("render.pages", len(missing))
+
+        with METRICS.span("render.batch"):
+            rendered = (backend or RenderBackend()).map(
+                [pages[index] for index in missing],
+                [zooms[index] for index in missing],
+            )
+
+            for index, img in zip(missing, rendered):
+                imgs[index] = img
+                self.put(keys[index], img)
+                if index in paths and self.store is not None:
+                    self.store.save(paths[index], img.image())
+        # every page was either found or rendered
+        return cast(List[PageImage], imgs)
+
+    def stored_path(self, page: fitz.Page, zoom: float) -> str:
+        """Gets the path the render of a page is kept at on disk or '' if it is not kept"""
+        if self.store is None:
+            return ""
+
+        with MUPDF_LOCK:
+            if not self.store.accepts(page.parent, int(page.rect.width * zoom)):
+                return ""
+            return self.store.path(page, zoom)
+
+    def stored(self, page: fitz.Page, zoom: float) -> bool:
+        """Checks if the render of a page is kept on disk"""
+        path = self.stored_path(page, zoom)
+        return bool(path) and self.store is not None and self.store.contains(path)
+
+    def drop_document(self, doc: fitz.Document) -> None:
+        """Removes all images rendered from the given document"""
+        with self._lock:
+            keys = [
+                key
+                for key in self._images
+                if isinstance(key, tuple) and key[0] == id(doc)
+            ]
+            for key in keys:
+                self.size -= self._nbytes(self._images.pop(key))
+
+    def clear(self) -> None:
+        """Removes all cached images"""
+        with self._lock:
+            self._images.clear()
+            self.size = 0
+
+    @staticmethod
+    def _nbytes(img: PageImage) -> int:
+        """Gets the number of bytes an image occupies"""
+        return img.nbytes
+
+
+# ***************** #
+#  Render Backends  #
+# ***************** #
+class RenderBackend:
+    """Renders pages one after another on the calling thread"""
+
+    name = "serial"
+
+    def map(
+        self, pages: Sequence[fitz.Page], zooms: Sequence[float]
+    ) -> Iterator[PageImage]:
+        """Renders the pages with the according zoom and yields them in order"""
+        return map(render_page, pages, zooms)
+
+    def close(self) -> None:
+        """Releases the resources held by the backend"""
+
+
+class ThreadBackend(RenderBackend):
+    """Renders pages on a thread pool
+
+    MuPDF itself is serialized by a lock, so only the conversion to images
+    overlaps. The backend keeps the caller free while pages are rendered.
+    """
+
+    name = "thread"
+
+    def __init__(self, workers: Optional[int] = None):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def map(
+        self, pages: Sequence[fitz.Page], zooms: Sequence[float]
+    ) -> Iterator[PageImage]:
+        """Renders the pages with the according zoom and yields them in order"""
+        return self._executor.map(render_page, pages, zooms)
+
+    def close(self) -> None:
+        """Waits for running renders and stops the threads"""
+        self._executor.shutdown()
+
+
+def _render_range(
+    numbers: Sequence[int], zooms: Sequence[float], rotations: Sequence[int]
+) -> Tuple[str, List[Tuple[int, int, int, int]]]:
+    """Renders a range of pages in a worker process into one shared memory block
+
+    Pages are written as PNM images. Returns the name of the block and the
+    offset, size, width and height of each page, so no pixel data needs to be
+    pickled.
+    """
+    doc = worker_document()
+    pixmaps = []
+    for number, zoom, rotation in zip(numbers, zooms, rotations):
+        page = doc[number]
+        matrix = fitz.Matrix(zoom, zoom).prerotate(rotation - page.rotation)
+        pixmaps.append(page.get_pixmap(matrix=matrix))
+
+    headers = [PageImage.header(pix.width, pix.height, pix.n) for pix in pixmaps]
+    sizes = [len(header) + len(pix.samples_mv) for header, pix in zip(headers, pixmaps)]
+    block = shared_memory.SharedMemory(create=True, size=max(sum(sizes), 1))
+    buf = cast(memoryview, block.buf)  # only None once closed
+    layout = []
+    offset = 0
+    for header, pix, size in zip(headers, pixmaps, sizes):
+        # the pixels are copied straight behind the header
+        buf[offset : offset + len(header)] = header
+        buf[offset + len(header) : offset + size] = pix.samples_mv
+        layout.append((offset, size, pix.width, pix.height))
+        offset += size
+
+    name = block.name
+    block.close()
+    return name, layout
+
+
+def _collect_range(
+    name: str, layout: List[Tuple[int, int, int, int]]
+) -> List[PageImage]:
+    """Copies the pages out of a shared memory block and releases it"""
+    block = shared_memory.SharedMemory(name=name)
+    buf = cast(memoryview, block.buf)  # only None once closed
+    imgs = []
+    try:
+        for offset, size, width, height in layout:
+            view = buf[offset : offset + size]
+            imgs.append(PageImage(width, height, bytes(view)))
+            view.release()
+    finally:
+        block.close()
+        block.unlink()
+    return imgs
+
+
+class ProcessBackend(RenderBackend):
+    """Renders page ranges in worker processes each holding its own copy of the document
+
+    Workers open the document by path, so pages of documents without a file or
+    with unsaved changes are rendered on the calling thread instead. The workers
+    are started again when the file changes, e.g. after saving over it, and are
+    spawned since forking a process running threads is unsafe.
+    """
+
+    name = "process"
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._file: Tuple[str, int, int] = ("", 0, 0)  # path, size and mtime
+
+        # let the workers register their shared memory with our tracker
+        resource_tracker.ensure_running()
+
+    def map(
+        self, pages: Sequence[fitz.Page], zooms: Sequence[float]
+    ) -> Iterator[PageImage]:
+        """Renders the pages with the according zoom and yields them in order"""
+        if len(pages) == 0:
+            return iter(())
+
+        doc = pages[0].parent
+        if (
+            not doc.name
+            or doc.is_dirty
+            or any(page.parent is not doc for page in pages)
+        ):
+            return super().map(pages, zooms)
+
+        executor = self._executor_for(doc.name)
+
+        # split into contiguous chunks, a few per worker to balance the load
+        chunk = max(len(pages) // (self.workers * 4), 1)
+        ranges = [
+            (
+                [page.number for page in pages[i : i + chunk]],
+                zooms[i : i + chunk],
+                [page.rotation for page in pages[i : i + chunk]],
+            )
+            for i in range(0, len(pages), chunk)
+        ]
+        results = executor.map(_render_range, *zip(*ranges))
+
+        return (img for result in results for img in _collect_range(*result))
+
+    def _executor_for(self, path: str) -> concurrent.futures.ProcessPoolExecutor:
+        """Gets a pool whose workers opened the document at path as it is now"""
+        stat = os.stat(path)
+        file = (path, stat.st_size, stat.st_mtime_ns)
+        if self._executor is None or self._file != file:
+            self.close()
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=open_worker_document,
+                initargs=(path,),
+            )
+            self._file = file
+        return self._executor
+
+    def close(self) -> None:
+        """Stops the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+BACKENDS: Dict[str, type] = {
+    backend.name: backend for backend in (RenderBackend, ThreadBackend, ProcessBackend)
+}
+
+
+def make_backend(name: str) -> RenderBackend:
+    """Creates the render backend with the given name"""
+    if name not in BACKENDS:
+        raise ValueError(f"Backend must be one of: {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+# ************* #
+#  Page Loader  #
+# ************* #
+class PageLoader:
+    """Renders pages on a background thread and queues the finished images
+
+    Pages missing in the cache may first be rendered at a fraction of their zoom
+    as quick preview and then at full quality. Results are put on the results
+    queue as (generation, index, image, final) for the UI to pick up; a newer
+    submit makes the results of the former one obsolete. Tiles of large pages
+    are rendered before the pages and queued with (index, box) as index.
+    Previews are drafts and while the view is scrolled only previews are
+    rendered, pages in the cache are still shown at full quality.
+    """
+
+    preview_factor = 0.25  # zoom of the preview relative to the final zoom
+    preview_gray = False  # render previews in grayscale
+    chunk_size = 8  # pages rendered in one batch at full quality
+
+    def __init__(self):
+        self.generation = 0
+        self.results: "queue.Queue[Tuple[int, Hashable, PageImage, bool]]" = (
+            queue.Queue()
+        )
+        self._jobs: queue.Queue = queue.Queue()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self) -> bool:
+        """Checks if rendering is in progress or results wait to be picked up"""
+        return self._jobs.unfinished_tasks > 0 or not self.results.empty()
+
+    def submit(
+        self,
+        items: Sequence[Tuple[int, fitz.Page, float, bool]],
+        cache: RenderCache,
+        backend: Optional[RenderBackend] = None,
+        tiles: Sequence[Tuple[int, Tuple[int, int, int, int], fitz.Page, float]] = (),
+        draft: bool = False,
+    ) -> int:
+        """Queues (index, page, zoom, preview) items to render and cancels the former ones
+
+        Previews are only rendered for items asking for one. Tiles are given as
+        (index, box, page, zoom). With draft no page is rendered at full quality.
+        """
+        self.generation += 1
+        self._jobs.put(
+            (self.generation, list(items), cache, backend, list(tiles), draft)
+        )
+        return self.generation
+
+    def cancel(self) -> None:
+        """Makes all pending renders obsolete"""
+        self.generation += 1
+
+    def wait(self) -> None:
+        """Blocks until the background thread finished all submitted jobs"""
+        self._jobs.join()
+
+    def close(self) -> None:
+        """Stops the background thread"""
+        self.cancel()
+        self._jobs.put(None)
+
+    def _run(self) -> None:
+        """Main loop of the background thread"""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            try:
+                self._render(*job)
+            finally:
+                self._jobs.task_done()
+
+    def _render(self, generation, items, cache, backend, tiles, draft) -> None:
+        """Renders the tiles, the previews and then the final images of the items"""
+        # tiles are only requested for the part of a page in view
+        for index, box, page, zoom in tiles:
+            if generation != self.generation:
+                return
+            img = cache.render_tile(page, zoom, box)
+            self.results.put((generation, (index, box), img, True))
+
+        with MUPDF_LOCK:
+            keys = [cache.key(page, zoom) for _, page, zoom, _ in items]
+
+        # quick low resolution pass for pages which will take a while
+        for (index, page, zoom, preview), key in zip(items, keys):
+            if generation != self.generation:
+                return
+            if not preview or key in cache or cache.stored(page, zoom):
+                continue
+
+            img = render_page(
+                page, zoom * self.preview_factor, draft=True, gray=self.preview_gray
+            )
+            METRICS.count("render.previews")
+            size = (
+                int(img.width / self.preview_factor),
+                int(img.height / self.preview_factor),
+            )
+            # the only render needing PIL, to scale the preview up
+            preview = PageImage.from_image(
+                img.image().resize(size, Image.Resampling.BILINEAR)
+            )
+            self.results.put((generation, index, preview, False))
+
+        if draft:
+            # pages which need no rendering are shown at full quality anyway
+            items = [
+                item
+                for item, key in zip(items, keys)
+                if key in cache or cache.stored(item[1], item[2])
+            ]
+
+        # full quality pass
+        for i in range(0, len(items), self.chunk_size):
+            if generation != self.generation:
+                return
+
+            chunk = items[i : i + self.chunk_size]
+            imgs = cache.render_pages(
+                [item[1] for item in chunk], [item[2] for item in chunk], backend
+            )
+            for (index, *_), img in zip(chunk, imgs):
+                self.results.put((generation, index, img, True))
@@ -0,0 +1,189 @@
+import concurrent.futures
+import multiprocessing
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import fitz  # PyMuPDF
+
+from document import open_worker_document, worker_document
+from metrics import METRICS
+from pagemodel import PageRef
+from rendering import MUPDF_LOCK
+
+__all__ = ["TextIndex", "Indexer", "words", "rotation_matrix", "hit_rects"]
+
+_WORD = re.compile(r"\w+")
+
+
+def words(text: str) -> List[str]:
+    """Splits text into lower case words"""
+    return _WORD.findall(text.lower())
+
+
+def rotation_matrix(width: float, height: float, rotation: int) -> fitz.Matrix:
+    """Gets the matrix turning points of an unrotated width x height page by rotation"""
+    rotation %= 360
+    if rotation == 90:
+        return fitz.Matrix(0, 1, -1, 0, height, 0)
+    if rotation == 180:
+        return fitz.Matrix(-1, 0, 0, -1, width, height)
+    if rotation == 270:
+        return fitz.Matrix(0, -1, 1, 0, 0, width)
+    return fitz.Matrix(1, 0, 0, 1, 0, 0)
+
+
+def hit_rects(page: PageRef, phrase: str) -> List[fitz.Rect]:
+    """Finds the phrase on a referenced page in the coordinates of the page as displayed"""
+    # text is found in the coordinates of the unrotated page
+    width, height = page.width, page.height
+    if page.rotation % 180 == 90:
+        width, height = height, width
+    matrix = rotation_matrix(width, height, page.rotation)
+
+    return [rect * matrix for rect in page.load().search_for(phrase)]
+
+
+class TextIndex:
+    """Inverted index from words to the numbers of the pages containing them
+
+    Pages can be added in any order while the index is searched. A phrase is
+    looked up by intersecting the pages of its words and then checked against
+    the normalized text of those pages.
+    """
+
+    def __init__(self):
+        self.pages: Dict[int, str] = {}  # normalized text by page number
+        self._words: Dict[str, Set[int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def add(self, number: int, text: str) -> None:
+        """Indexes the text of the page with the given number"""
+        tokens = words(text)
+        with self._lock:
+            self.pages[number] = " ".join(tokens)
+            for word in set(tokens):
+                self._words.setdefault(word, set()).add(number)
+
+    def search(self, phrase: str) -> List[int]:
+        """Gets the numbers of the indexed pages containing the phrase"""
+        tokens = words(phrase)
+        if not tokens:
+            return []
+
+        with self._lock:
+            # start with the rarest word to keep the candidates few
+            postings = sorted(
+                (self._words.get(word, set()) for word in set(tokens)), key=len
+            )
+            candidates = set(postings[0]).intersection(*postings[1:])
+            if len(tokens) > 1:
+                normalized = " ".join(tokens)
+                candidates = {
+                    number for number in candidates if normalized in self.pages[number]
+                }
+        return sorted(candidates)
+
+
+def _extract_range(numbers: Sequence[int]) -> List[Tuple[int, str]]:
+    """Extracts the text of a range of pages in a worker process"""
+    doc = worker_document()
+    return [(number, doc[number].get_text()) for number in numbers]
+
+
+class Indexer:
+    """Extracts the text of all pages in the background and fills a TextIndex
+
+    Documents with a file are split into ranges extracted in parallel by
+    worker processes, each opening the file itself. Other documents are read
+    page by page on a thread. The index can be searched at any time and holds
+    more pages the longer the indexer runs.
+    """
+
+    chunk_size = 32  # pages extracted by a worker at once
+
+    def __init__(self, document: fitz.Document, workers: Optional[int] = None):
+        self.document = document
+        # workers open the file themselves, unsaved changes are only in memory
+        self.path = document.name if not document.is_dirty else ""
+        self.workers = workers
+        self.index = TextIndex()
+        self.total = len(document)
+        self.error = ""
+
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "Indexer":
+        """Starts indexing in the background"""
+        self._thread.start()
+        return self
+
+    @property
+    def done(self) -> bool:
+        """Checks if indexing finished or stopped"""
+        return not self._thread.is_alive() and self._thread.ident is not None
+
+    @property
+    def progress(self) -> float:
+        """Gets the share of pages indexed"""
+        return len(self.index) / self.total if self.total else 1.0
+
+    def search(self, phrase: str) -> List[int]:
+        """Gets the numbers of the pages indexed so far containing the phrase"""
+        with METRICS.span("search.query"):
+            return self.index.search(phrase)
+
+    def cancel(self) -> None:
+        """Stops indexing and waits for the background thread"""
+        self._cancelled.set()
+        if self._thread.ident is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        """Main function of the background thread"""
+        try:
+            if self.path:
+                self._extract_parallel()
+            else:
+                self._extract_serial()
+        except Exception as error:  # skipcq: PYL-W0703
+            self.error = str(error)
+
+    def _extract_serial(self) -> None:
+        """Extracts the pages one after the other"""
+        for number in range(self.total):
+            if self._cancelled.is_set():
+                return
+            with MUPDF_LOCK:
+                text = self.document[number].get_text()
+            self.index.add(number, text)
+            METRICS.count("search.indexed")
+
+    def _extract_parallel(self) -> None:
+        """Extracts ranges of pages in worker processes, spawned as threads are running"""
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=open_worker_document,
+            initargs=(self.path,),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _extract_range,
+                    range(start, min(start + self.chunk_size, self.total)),
+                )
+                for start in range(0, self.total, self.chunk_size)
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                if self._cancelled.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    return
+                texts = future.result()
+                for number, text in texts:
+                    self.index.add(number, text)
+                METRICS.count("search.indexed", len(texts))
@@ -0,0 +1,107 @@
+import itertools
+from typing import Iterable, Iterator, List
+
+__all__ = ["Selection"]
+
+# flips the selection state of every byte of the bit set
+_INVERT = bytes([1]) + bytes(255)
+
+
+class Selection:
+    """Set of selected page indices stored as one byte per page
+
+    Adding, removing and toggling a page are O(1) and ranges are changed with
+    one slice assignment. Operations return the indices whose state changed,
+    so only those pages need to be repainted. The set grows with the largest
+    index added.
+    """
+
+    __slots__ = ("_bits", "_count")
+
+    def __init__(self, indices: Iterable[int] = ()):
+        self._bits = bytearray()
+        self._count = 0
+        for index in indices:
+            self.add(index)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __bool__(self) -> bool:
+        return self._count > 0
+
+    def __contains__(self, index: int) -> bool:
+        return 0 <= index < len(self._bits) and self._bits[index] == 1
+
+    def __iter__(self) -> Iterator[int]:
+        """Iterates the selected indices in ascending order"""
+        return itertools.compress(range(len(self._bits)), self._bits)
+
+    def __repr__(self) -> str:
+        return f"Selection({list(self)})"
+
+    @property
+    def first(self) -> int:
+        """Gets the smallest selected index or -1 if nothing is selected"""
+        return self._bits.find(1)
+
+    def positions(self) -> List[int]:
+        """Gets the selected indices in ascending order"""
+        return list(self)
+
+    def _grow(self, size: int) -> None:
+        """Makes room for indices below size"""
+        if size > len(self._bits):
+            self._bits.extend(bytes(size - len(self._bits)))
+
+    def add(self, index: int) -> bool:
+        """Selects a page and returns whether it was not selected before"""
+        self._grow(index + 1)
+        if self._bits[index]:
+            return False
+        self._bits[index] = 1
+        self._count += 1
+        return True
+
+    def discard(self, index: int) -> bool:
+        """Deselects a page and returns whether it was selected before"""
+        if index not in self:
+            return False
+        self._bits[index] = 0
+        self._count -= 1
+        return True
+
+    def toggle(self, index: int) -> bool:
+        """Flips the selection of a page and returns whether it is selected now"""
+        if self.discard(index):
+            return False
+        return self.add(index)
+
+    def add_range(self, start: int, stop: int) -> List[int]:
+        """Selects the pages from start to stop and returns the newly selected ones"""
+        self._grow(stop)
+        changed = list(
+            itertools.compress(
+                range(start, stop), self._bits[start:stop].translate(_INVERT)
+            )
+        )
+        self._bits[start:stop] = b"\x01" * (stop - start)
+        self._count += len(changed)
+        return changed
+
+    def discard_range(self, start: int, stop: int) -> List[int]:
+        """Deselects the pages from start to stop and returns the formerly selected ones"""
+        stop = min(stop, len(self._bits))
+        if start >= stop:
+            return []
+        changed = list(itertools.compress(range(start, stop), self._bits[start:stop]))
+        self._bits[start:stop] = bytes(stop - start)
+        self._count -= len(changed)
+        return changed
+
+    def clear(self) -> List[int]:
+        """Deselects all pages and returns the formerly selected ones"""
+        changed = list(self)
+        self._bits = bytearray()
+        self._count = 0
+        return changed
@@ -1,4 +1,10 @@
 import time
+import unittest
+from typing import List, Tuple
+
+from history import Command, History
+from pagemodel import PageModel
+from selection import Selection
 
 
 def timer(function):
@@ -15,3 +21,162 @@ def timer(function):
         return value
 
     return inner_function
+
+
+def pages(count: int) -> PageModel:
+    """Creates a model of count pages without a document, numbered in order"""
+    model = PageModel()
+    for number in range(count):
+        model.append(number, 595, 842)
+    return model
+
+
+def state(model: PageModel) -> List[Tuple[int, int]]:
+    """Gets the number and rotation of each page of a model"""
+    return list(zip(model.numbers, model.rotations))
+
+
+class HistoryTest(unittest.TestCase):
+    """Round trips of the page commands through undo and redo"""
+
+    def round_trip(self, command: Command, expected: List[int]) -> None:
+        """Executes, undoes and redoes a command on ten pages"""
+        model = pages(10)
+        history = History(model)
+        before = state(model)
+
+        history.execute(command)
+        self.assertEqual(list(model.numbers), expected)
+        after = state(model)
+
+        history.undo()
+        self.assertEqual(state(model), before)
+        self.assertFalse(history.can_undo)
+        self.assertTrue(history.can_redo)
+
+        history.redo()
+        self.assertEqual(state(model), after)
+        self.assertTrue(history.can_undo)
+        self.assertFalse(history.can_redo)
+
+    def test_move(self):
+        self.round_trip(Command.move([1, 2, 7], 4), [0, 3, 4, 5, 1, 2, 7, 6, 8, 9])
+
+    def test_move_to_end(self):
+        self.round_trip(Command.move([0, 1], 8), [2, 3, 4, 5, 6, 7, 8, 9, 0, 1])
+
+    def test_delete(self):
+        self.round_trip(Command.delete([0, 5, 9]), [1, 2, 3, 4, 6, 7, 8])
+
+    def test_insert(self):
+        inserted = PageModel()
+        inserted.append(20, 595, 842)
+        inserted.append(21, 595, 842)
+        self.round_trip(
+            Command.insert(3, inserted), [0, 1, 2, 20, 21, 3, 4, 5, 6, 7, 8, 9]
+        )
+
+    def test_rotate(self):
+        model = pages(10)
+        history = History(model)
+
+        history.execute(Command.rotate([2, 3], 90))
+        history.execute(Command.rotate([3], 90))
+        self.assertEqual(list(model.rotations), [0, 0, 90, 180, 0, 0, 0, 0, 0, 0])
+
+        history.undo()
+        self.assertEqual(list(model.rotations), [0, 0, 90, 90, 0, 0, 0, 0, 0, 0])
+        history.undo()
+        self.assertEqual(list(model.rotations), [0] * 10)
+        history.redo()
+        history.redo()
+        self.assertEqual(list(model.rotations), [0, 0, 90, 180, 0, 0, 0, 0, 0, 0])
+
+    def test_sequence(self):
+        model = pages(10)
+        history = History(model)
+        states = [state(model)]
+
+        for command in (
+            Command.delete([4]),
+            Command.move([0], 5),
+            Command.rotate([1, 2], 270),
+            Command.insert(0, pages(2)),
+        ):
+            history.execute(command)
+            states.append(state(model))
+
+        for expected in reversed(states[:-1]):
+            history.undo()
+            self.assertEqual(state(model), expected)
+        self.assertIsNone(history.undo())
+
+        for expected in states[1:]:
+            history.redo()
+            self.assertEqual(state(model), expected)
+        self.assertIsNone(history.redo())
+
+    def test_execute_clears_redo(self):
+        history = History(pages(10))
+        history.execute(Command.delete([0]))
+        history.undo()
+        history.execute(Command.rotate([0], 90))
+        self.assertFalse(history.can_redo)
+
+    def test_limit(self):
+        history = History(pages(10), limit=2)
+        for _ in range(3):
+            history.execute(Command.rotate([0], 90))
+        history.undo()
+        history.undo()
+        self.assertFalse(history.can_undo)
+        self.assertEqual(history.model.rotations[0], 90)
+
+
+class SelectionTest(unittest.TestCase):
+    """Changed indices returned by the selection operations"""
+
+    def test_add_discard(self):
+        selection = Selection()
+        self.assertTrue(selection.add(3))
+        self.assertFalse(selection.add(3))
+        self.assertTrue(selection.discard(3))
+        self.assertFalse(selection.discard(3))
+        self.assertFalse(selection.discard(100))
+        self.assertEqual(len(selection), 0)
+
+    def test_toggle(self):
+        selection = Selection([2])
+        self.assertTrue(selection.toggle(5))
+        self.assertFalse(selection.toggle(2))
+        self.assertEqual(selection.positions(), [5])
+        self.assertFalse(selection.toggle(5))
+        self.assertFalse(selection)
+        self.assertEqual(selection.first, -1)
+
+    def test_add_range(self):
+        selection = Selection([2, 4])
+        self.assertEqual(selection.add_range(1, 6), [1, 3, 5])
+        self.assertEqual(selection.add_range(1, 6), [])
+        self.assertEqual(selection.add_range(8, 10), [8, 9])
+        self.assertEqual(selection.positions(), [1, 2, 3, 4, 5, 8, 9])
+        self.assertEqual(len(selection), 7)
+
+    def test_discard_range(self):
+        selection = Selection([1, 3, 4, 8])
+        self.assertEqual(selection.discard_range(2, 5), [3, 4])
+        self.assertEqual(selection.discard_range(2, 5), [])
+        self.assertEqual(selection.discard_range(6, 50), [8])
+        self.assertEqual(selection.discard_range(20, 30), [])
+        self.assertEqual(selection.positions(), [1])
+        self.assertEqual(len(selection), 1)
+
+    def test_clear(self):
+        selection = Selection([7, 0])
+        self.assertEqual(selection.clear(), [0, 7])
+        self.assertEqual(selection.clear(), [])
+        self.assertNotIn(7, selection)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Dict, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+__all__ = ["ThumbnailStore", "default_directory"]
+
+
+def default_directory() -> str:
+    """Gets the directory thumbnails are stored in by default"""
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache, "pyditor", "thumbnails")
+
+
+class ThumbnailStore:
+    """Disk backed store of small rendered pages surviving between sessions
+
+    Thumbnails are grouped in a directory per document fingerprint, which is
+    taken from the size, the head and the tail of the file and the PDF ID. A
+    changed file therefore gets a new fingerprint and the thumbnails of its
+    former version are removed. Once the store grows beyond its limit the least
+    recently used thumbnails are deleted.
+    """
+
+    index_name = "index.json"
+    sample_size = 64 * 1024  # bytes hashed from the start and end of a file
+
+    def __init__(
+        self, directory: str = "", limit: int = 256 * 1024**2, max_width: int = 320
+    ):
+        self.directory = directory or default_directory()
+        self.limit = limit  # maximum number of bytes on disk
+        self.max_width = max_width  # wider renders are not stored
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        # fingerprints by path together with the file stats they were taken from
+        self._fingerprints: Dict[str, Tuple[str, int, int]] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._index = self._read_index()
+        self.size = sum(os.path.getsize(path) for path, _ in self._files())
+
+    def accepts(self, doc: fitz.Document, width: int) -> bool:
+        """Checks if renders of the document with the given width can be stored"""
+        return bool(doc.name) and not doc.is_dirty and width <= self.max_width
+
+    def fingerprint(self, doc: fitz.Document) -> str:
+        """Gets the fingerprint of the file of the document"""
+        stat = os.stat(doc.name)
+        with self._lock:
+            known = self._fingerprints.get(doc.name)
+            if known and known[1:] == (stat.st_size, stat.st_mtime_ns):
+                return known[0]
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(stat.st_size).encode())
+        with open(doc.name, "rb") as file:
+            digest.update(file.read(self.sample_size))
+            file.seek(max(stat.st_size - self.sample_size, 0))
+            digest.update(file.read(self.sample_size))
+        digest.update(doc.pdf_trailer().encode() if doc.is_pdf else b"")
+        fingerprint = digest.hexdigest()
+
+        with self._lock:
+            self._fingerprints[doc.name] = (fingerprint, stat.st_size, stat.st_mtime_ns)
+            self._forget_stale(doc.name, fingerprint)
+        return fingerprint
+
+    def path(self, page: fitz.Page, zoom: float) -> str:
+        """Gets the path of the thumbnail of a page rendered with the given zoom"""
+        name = f"{page.number}-{page.rotation}-{round(zoom, 4)}.png"
+        return os.path.join(self.directory, self.fingerprint(page.parent), name)
+
+    @staticmethod
+    def contains(path: str) -> bool:
+        """Checks if a thumbnail is stored at path"""
+        return os.path.exists(path)
+
+    def load(self, path: str) -> Optional[Image.Image]:
+        """Loads the thumbnail stored at path and marks it as recently used"""
+        try:
+            with Image.open(path) as img:
+                img.load()
+            os.utime(path)
+        except (OSError, SyntaxError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return img
+
+    def save(self, path: str, img: Image.Image) -> None:
+        """Stores a thumbnail at path and evicts old ones above the limit"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a thumbnail saved again replaces the former file
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        img.save(path, "PNG", compress_level=1)
+
+        with self._lock:
+            self.size += os.path.getsize(path) - replaced
+            if self.size > self.limit:
+                self._evict()
+
+    def clear(self) -> None:
+        """Removes all stored thumbnails"""
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+            self._index.clear()
+            self._fingerprints.clear()
+            self.size = 0
+
+    def _files(self):
+        """Yields path and last use of every stored thumbnail"""
+        for entry in os.scandir(self.directory):
+            if entry.is_dir():
+                for file in os.scandir(entry.path):
+                    yield file.path, file.stat().st_mtime
+
+    def _evict(self) -> None:
+        """Deletes the least recently used thumbnails until the store fits its limit"""
+        # make room for some more thumbnails to not evict on every save
+        target = self.limit * 0.9
+        for path, _ in sorted(self._files(), key=lambda file: file[1]):
+            if self.size <= target:
+                break
+            try:
+                self.size -= os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _forget_stale(self, name: str, fingerprint: str) -> None:
+        """Removes thumbnails of a former version of the file"""
+        former = self._index.get(name)
+        if former == fingerprint:
+            return
+
+        if former:
+            directory = os.path.join(self.directory, former)
+            if os.path.isdir(directory):
+                self.size -= sum(
+                    entry.stat().st_size for entry in os.scandir(directory)
+                )
+                shutil.rmtree(directory, ignore_errors=True)
+
+        self._index[name] = fingerprint
+        self._write_index()
+
+    def _read_index(self) -> Dict[str, str]:
+        """Reads which fingerprint the files were last seen with"""
+        try:
+            with open(os.path.join(self.directory, self.index_name)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self) -> None:
+        """Writes which fingerprint the files were last seen with"""
+        with open(os.path.join(self.directory, self.index_name), "w") as file:
+            json.dump(self._index, file)
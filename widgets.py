@@ -1,11 +1,24 @@
-import concurrent.futures
-import itertools
+import bisect
 import platform
+import queue
+import time
 import tkinter as tk
+from math import ceil
+from tkinter import ttk
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
-from PIL import Image, ImageTk
+from metrics import METRICS
+from pagemodel import PageModel
+from rendering import (
+    MUPDF_LOCK,
+    PageImage,
+    PageLoader,
+    RenderBackend,
+    RenderCache,
+    fit_zoom,
+)
 
-__all__ = ["ScrollFrame", "CollapsibleFrame", "PageViewer"]
+__all__ = ["ScrollFrame", "CollapsibleFrame", "PageViewer", "ProgressDialog"]
 
 
 # ************************ #
@@ -243,8 +256,7 @@ class CollapsibleFrame(tk.Frame):
             self._hide()
 
     def set_document(self):
-        """Placeholder is called when new document is opened"""
-        raise NotImplementedError()
+        """Keeps the frame as it is when a new document is opened"""
 
     def _hide(self) -> None:
         """Hide content expects the button"""
@@ -266,10 +278,25 @@ class CollapsibleFrame(tk.Frame):
 #  Scrollable Frame Class  #
 # ************************ #
 class PageViewer(ScrollFrame):
-    """Scrollable Frame to display pages of a pdf document"""
+    """Scrollable Frame to display pages of a pdf document
+
+    Pages are drawn as image items on the canvas together with a rectangle
+    behind each page to show its selection, so no widget is created per page.
+    Pages with more pixels than tile_threshold are never rendered as a whole,
+    only the tiles of them in view are, so memory follows the viewport size.
+    """
+
+    page_background = "#cecfd0"
+    selected_background = "blue"
+    show_titles = False  # draw a title below each page
+    tile_size = 512  # edge of the tiles large pages are rendered in
+    tile_threshold = 0  # pixels of a page above which it is tiled, 0 never
 
     def __init__(self, parent, *args, **kwargs):
-        self.page_label = []
+        # canvas items of each page
+        self.page_items: List[int] = []
+        self._frames: List[int] = []
+        self._photos: list = []  # references to the images shown by the items
 
         if "column" in kwargs:
             self.column = kwargs["column"]
@@ -277,16 +304,71 @@ class PageViewer(ScrollFrame):
         else:
             self.column = 1
 
+        # render only pages near the viewport instead of the whole document
+        if "virtual" in kwargs:
+            self.virtual = kwargs["virtual"]
+            kwargs.pop("virtual")
+        else:
+            self.virtual = True
+
+        # margin above and below the viewport to render in advance in viewport heights
+        if "prefetch" in kwargs:
+            self.prefetch = kwargs["prefetch"]
+            kwargs.pop("prefetch")
+        else:
+            self.prefetch = 1.0
+
         # constants
         self._scaling = 1
         self.canvas_width = 0
         self.canvas_height = 0
         self.offset_vertical = 10
         self.offset_horizontal = 10
+        self.padding = 5  # space around each page
+        self.border = 3  # width of the selection frame
+        self.title_height = 16
+
+        # layout of the pages
+        self._sizes: List[Tuple[int, int]] = []  # size of each rendered page
+        self._slots: List[Tuple[float, float, int, int]] = []  # x, y, width, height
+        self._offsets: List[float] = []  # vertical position of each page
+
+        # state of the virtualized rendering
+        self._shown: Set[int] = set()  # indices of pages showing a preview or page
+        self._rendered: Set[int] = set()  # indices of pages showing the final page
+        self._painted: Set[int] = set()  # indices of pages showing a selection frame
+        self._tiles: Dict[Tuple[int, Tuple[int, int, int, int]], tuple] = {}
+        self._blank: Optional[tk.PhotoImage] = None  # shown by pages not rendered yet
+        self._render_pending = None
+
+        # pages are rendered in the background and picked up from the event loop
+        self.loader = PageLoader()
+        self.poll_interval = 20  # ms between checks for rendered pages
+        self.poll_budget = 0.015  # seconds per check to spend on displaying pages
+        self._poll_pending = None
+
+        # bursts of layout changes are merged into one update
+        self.update_delay = 150  # ms to wait for further changes
+        self._update_pending = None
+
+        # while scrolling only drafts are rendered, final pages once it stopped
+        self.scroll_settle = 150  # ms without scrolling until scrolling stopped
+        self._scroll_pending = None
 
         super().__init__(parent, *args, **kwargs)
-        self.pages = []
+        self.pages = PageModel()
         self.handler.add_funcs("set-document", self.set_document)
+        self.handler.add_funcs("release-document", self.release_document)
+
+        # pages are drawn directly on the canvas instead of the viewPort frame
+        self.canvas.delete(self.canvas_window)
+
+        # render pages coming into view whenever the visible area changes
+        self.canvas.configure(yscrollcommand=self._on_view_change)
+        self.canvas.bind("<Configure>", self._on_resize)
+        # tiles of large pages follow the horizontal view too
+        self.canvas.configure(xscrollcommand=self._on_xview_change)
+        self.yscrollbar.configure(command=self._on_scrollbar)
 
     @property
     def scaling(self):
@@ -294,110 +376,602 @@ class PageViewer(ScrollFrame):
         return self._scaling
 
     def set_document(self):
-        """Fetches the new opened document"""
-        self.pages = self.handler.get_values("document")
+        """Fetches the pages of the new opened document"""
+        self.pages = self.handler.get_values("pages")
         self.load_pages()
 
+    def release_document(self) -> None:
+        """Drops all pages so the document can be closed, also once the window is gone"""
+        # the page being rendered must not outlive the document
+        self.loader.cancel()
+        self.loader.wait()
+
+        try:
+            self.clear()
+        except tk.TclError:
+            pass  # the canvas was destroyed with the window
+        self.pages = PageModel()
+
+    @property
+    def render_cache(self) -> RenderCache:
+        """Gets the render cache shared between the viewers"""
+        if not self.handler.check_value("render-cache"):
+            self.handler.add_values("render-cache", RenderCache())
+        return self.handler.get_values("render-cache")
+
+    @property
+    def render_backend(self) -> Optional[RenderBackend]:
+        """Gets the backend rendering missing pages"""
+        if self.handler.check_value("render-backend"):
+            return self.handler.get_values("render-backend")
+        return None
+
+    def _on_frame_change(self, _event):
+        """The scroll region is set by the page layout"""
+
+    @METRICS.timed("viewer.load_pages")
     def load_pages(self) -> None:
-        """Displays all pages of the document vertically"""
+        """Lays out all pages of the document and renders the visible ones"""
         if len(self.pages) == 0:
             return None
 
-        # clear viewPort frame
+        # remove pages of the former document
         self.clear()
 
         # get page viewer properties
         self.get_properties()
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            imgs = executor.map(
-                self.convert_page,
-                self.pages,
-                itertools.repeat(self.scaling, times=len(self.pages)),
+        # lay out correctly sized slots, rendering happens in the background
+        scaling = self.scaling
+        self.layout(scaling)
+        for index, page in enumerate(self.pages):
+            self.page_items.append(
+                self.blit_page(self.placeholder(page, scaling), index)
             )
 
-        for index, img in enumerate(imgs):
-            # convert to a displayable tk-image
-            tkImg = ImageTk.PhotoImage(img)
+        self.render_visible()
+        return None
 
-            labelImg = self.blit_page(tkImg, index)
+    def schedule_update(self) -> None:
+        """Updates the pages once no further change arrived for update_delay ms"""
+        # renders for the current layout are obsolete
+        self.loader.cancel()
 
-            # append label to pages to later display whether its selected
-            self.page_label.append(labelImg)
-        return None
+        if self._update_pending is not None:
+            self.after_cancel(self._update_pending)
+        self._update_pending = self.after(self.update_delay, self.update_pages)
 
-    # def update_vision(self):
-    #     current = int(
-    #        self.canvas.yview()[1] * (len(self.page_label) // self.column + 1) * self.column
-    #     )
-    #     if self.current != current:
-    #         self.update_pages(self.document)
-    #         self.current = current
+    def set_column(self, column: int) -> None:
+        """Regrids the pages into the given number of columns keeping the current page in view"""
+        current = self.visible_page()
+        self.column = column
+        self.update_pages()
 
+        if current is not None:
+            self.canvas.yview_moveto(self._offsets[current] / self.layout_height)
+
+    def visible_page(self) -> Optional[int]:
+        """Gets the index of the first page at the top of the viewport"""
+        if len(self._offsets) == 0:
+            return None
+        return max(bisect.bisect_right(self._offsets, self.canvas.canvasy(0)) - 1, 0)
+
+    @property
+    def idle(self) -> bool:
+        """Checks if no update, render or display of pages is pending"""
+        return (
+            self._update_pending is None
+            and self._render_pending is None
+            and self._poll_pending is None
+            and self._scroll_pending is None
+            and not self.loader.busy
+        )
+
+    @property
+    def photo_bytes(self) -> int:
+        """Gets the number of bytes held by the images shown on the canvas"""
+        photos = {id(photo): photo for photo in self._photos}
+        photos.update((id(photo), photo) for _, photo in self._tiles.values())
+        return sum(photo.width() * photo.height() * 4 for photo in photos.values())
+
+    @property
+    def layout_height(self) -> float:
+        """Gets the height of all laid out pages"""
+        return float(self.canvas.cget("scrollregion").split()[3])
+
+    def _on_resize(self, event):
+        """Updates the pages after the width of the canvas changed"""
+        if self.page_items and event.width != self.canvas_width:
+            self.schedule_update()
+
+    @METRICS.timed("viewer.update_pages")
     def update_pages(self):
-        """Recreate images and blit it on existing labels"""
-        document = self.handler.get_values("document")
-        self.get_properties()
+        """Relayout the pages and rerender those whose size changed"""
+        self._update_pending = None
+        if len(self.page_items) == 0:
+            return
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            imgs = executor.map(
-                self.convert_page,
-                document,
-                itertools.repeat(self.scaling, times=len(document)),
+        self.get_properties()
+        self.clear_tiles()
+
+        scaling = self.scaling
+        previous = self._sizes
+        self.layout(scaling)
+        for index, page in enumerate(self.pages):
+            if self._sizes[index] != previous[index]:
+                # pages keep showing their former image until rerendered
+                if index not in self._shown or self.is_tiled(index):
+                    self.show_image(index, self.placeholder(page, scaling))
+                    self._shown.discard(index)
+                self._rendered.discard(index)
+            self.move_page(index)
+
+        self.render_visible()
+
+    @METRICS.timed("viewer.refresh_pages")
+    def refresh_pages(self, first: int, last: Optional[int] = None) -> None:
+        """Redraws the pages from first up to last after the page model was edited
+
+        Without last all following pages are redrawn, as inserting or removing
+        pages shifts them. Items are reused, so only the difference in the number
+        of pages is created or deleted.
+        """
+        if len(self.page_items) == 0 and len(self.pages) == 0:
+            return
+        last = len(self.pages) if last is None else min(last, len(self.pages))
+
+        scaling = self.scaling
+        previous = self._slots[:]
+        self.layout(scaling)
+        self.clear_tiles()
+
+        # adjust the number of items to the number of pages
+        while len(self.page_items) > len(self.pages):
+            index = len(self.page_items) - 1
+            self.canvas.delete(self.page_items.pop(), self._frames.pop())
+            self.canvas.delete(f"title-{index}")
+            self._photos.pop()
+            self._painted.discard(index)
+        for index in range(len(self.page_items), len(self.pages)):
+            page = self.pages[index]
+            self.page_items.append(
+                self.blit_page(self.placeholder(page, scaling), index)
+            )
+        self._shown.intersection_update(range(len(self.pages)))
+        self._rendered.intersection_update(range(len(self.pages)))
+
+        cache = self.render_cache
+        visible = self.visible_range()
+        for index in range(first, last):
+            if index not in visible and index not in self._shown:
+                continue  # pages out of view show the blank already
+
+            # show already rendered pages in view at once, others once rendered
+            page = self.pages[index]
+            img = None
+            if index in visible and not self.is_tiled(index):
+                key = cache.key(page, self.page_zoom(page, scaling))
+                img = cache.get(key) if key in cache else None
+            if img is not None:
+                self.show_image(index, self.photo(img))
+                self._shown.add(index)
+                self._rendered.add(index)
+            else:
+                self.show_image(index, self.placeholder(page, scaling))
+                self._shown.discard(index)
+                self._rendered.discard(index)
+
+        for index, slot in enumerate(self._slots):
+            if index >= len(previous) or previous[index] != slot:
+                self.move_page(index)
+
+        self.render_visible()
+
+    @METRICS.timed("viewer.layout")
+    def layout(self, scaling) -> None:
+        """Calculates the position of each page and sets the scroll region"""
+        self._sizes = sizes = [self.page_size(page, scaling) for page in self.pages]
+        title = self.title_height if self.show_titles else 0
+        cell = self.padding + self.border
+
+        # every column is as wide as the widest page
+        column_width = max((width for width, _ in sizes), default=0) + 2 * cell
+        left = 0.0
+        if self.column == 1:
+            # center a single column in the frame
+            left = max(
+                (self.canvas_width - self.offset_horizontal - column_width) / 2, 0
             )
 
-        for index, img in enumerate(imgs):  # , start=self.current):
-            # convert to a displayable tk-image
-            tkImg = ImageTk.PhotoImage(img)
+        self._slots.clear()
+        top = float(cell)
+        for first in range(0, len(sizes), self.column):
+            row = sizes[first : first + self.column]
+            for column, (width, height) in enumerate(row):
+                x = left + column * column_width + (column_width - width) / 2
+                self._slots.append((x, top, width, height))
+            top += max(height for _, height in row) + title + 2 * cell
+
+        self._offsets = [y for _, y, _, _ in self._slots]
+        self.canvas.configure(
+            scrollregion=(0, 0, 2 * left + self.column * column_width, top)
+        )
 
-            self.page_label[index].config(image=tkImg)
-            self.page_label[index].image = tkImg
+    def page_size(self, rect, scaling) -> Tuple[int, int]:
+        """Calculates the size of a rendered page from its rect or page reference"""
+        zoom = self.page_zoom(rect, scaling)
+        return int(rect.width * zoom), int(rect.height * zoom)
 
-    def convert_page(self, page, scaling):
-        """Covert a given page object to a displayable Image and resize it"""
-        pix = page.get_pixmap()
+    def page_title(self, index: int) -> str:
+        """Gets the title drawn below the page at index"""
+        return f"Page {index + 1}"
 
-        # set the mode depending on alpha
-        mode = "RGBA" if pix.alpha else "RGB"
-        img = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
+    def _on_view_change(self, *args):
+        """Updates the scrollbar and schedules rendering of pages coming into view"""
+        self.yscrollbar.set(*args)
 
-        # rescale image to fit in the frame
-        if self.column == 1:
-            scale = (self.canvas_height - self.offset_horizontal) / img.size[1]
-        else:
-            scale = (
-                (self.canvas_width - self.offset_horizontal) / self.column
-            ) / img.size[0]
+        # coalesce several view changes into one render per idle cycle
+        if self._render_pending is None:
+            self._render_pending = self.after_idle(self.render_visible)
 
-        scale *= scaling
+    def _on_mouse_wheel(self, event):
+        """Scrolls vertically rendering drafts until scrolling stopped"""
+        super()._on_mouse_wheel(event)
+        self._scrolled()
 
-        scaleImg = img.resize((int(img.size[0] * scale), int(img.size[1] * scale)))
+    def _on_shift_mouse_wheel(self, event):
+        """Scrolls horizontally rendering drafts until scrolling stopped"""
+        super()._on_shift_mouse_wheel(event)
+        self._scrolled()
+
+    def _on_scrollbar(self, *args):
+        """Moves the view with the scrollbar rendering drafts until it is released"""
+        self.canvas.yview(*args)
+        self._scrolled()
+
+    def _scrolled(self) -> None:
+        """Marks the view as scrolling until no scroll arrived for scroll_settle ms"""
+        if self._scroll_pending is not None:
+            self.after_cancel(self._scroll_pending)
+        self._scroll_pending = self.after(self.scroll_settle, self._scroll_stopped)
+
+    def _scroll_stopped(self) -> None:
+        """Renders the pages in view at full quality after scrolling stopped"""
+        self._scroll_pending = None
+        if self._render_pending is None:
+            self._render_pending = self.after_idle(self.render_visible)
+
+    @property
+    def scrolling(self) -> bool:
+        """Checks if the view is being scrolled"""
+        return self._scroll_pending is not None
+
+    def _on_xview_change(self, *args):
+        """Updates the scrollbar and schedules rendering of tiles coming into view"""
+        self.xscrollbar.set(*args)
+
+        if self._render_pending is None:
+            self._render_pending = self.after_idle(self.render_visible)
+
+    def visible_range(self) -> range:
+        """Gets the indices of the pages within the viewport and the prefetch margin"""
+        if not self.virtual:
+            return range(len(self.page_items))
+
+        top = self.canvas.canvasy(0)
+        height = self.canvas.winfo_height()
+        margin = self.prefetch * height
+
+        # rows share the same offset, so round down to the first page of the row
+        first = bisect.bisect_right(self._offsets, top - margin) - 1
+        first = max(first // self.column * self.column, 0)
+        last = bisect.bisect_right(self._offsets, top + height + margin)
+
+        return range(first, last)
+
+    def index_at(self, event: tk.Event) -> Optional[int]:
+        """Gets the index of the page under the mouse pointer"""
+        x = self.canvas.canvasx(event.x)
+        y = self.canvas.canvasy(event.y)
+
+        row = bisect.bisect_right(self._offsets, y) - 1
+        if row < 0:
+            return None
 
-        return scaleImg
+        first = row // self.column * self.column
+        bottom = self.title_height if self.show_titles else 0
+        for index in range(first, min(first + self.column, len(self._slots))):
+            left, top, width, height = self._slots[index]
+            if left <= x <= left + width and top <= y <= top + height + bottom:
+                return index
+        return None
 
-    def blit_page(self, page, index):
-        """Blit given Image on label and returns it"""
-        labelImg = tk.Label(
-            master=self.viewPort,
-            image=page,
-            compound="top",
-            padx=3,
+    @METRICS.timed("viewer.render_visible")
+    def render_visible(self) -> None:
+        """Requests pages coming into view and drops pages out of view to placeholders"""
+        self._render_pending = None
+        if len(self.page_items) == 0:
+            return
+
+        visible = self.visible_range()
+        scaling = self.scaling
+
+        # release images which scrolled out of view
+        for index in self._shown.difference(visible):
+            self.show_image(index, self.placeholder(self.pages[index], scaling))
+        self._shown.intersection_update(visible)
+        self._rendered.intersection_update(visible)
+
+        # selection frames are only painted once pages come into view
+        self.repaint_selection(visible)
+
+        tiles = self.missing_tiles(visible)
+        missing = [
+            index
+            for index in visible
+            if index not in self._rendered and not self.is_tiled(index)
+        ]
+        if len(missing) == 0 and len(tiles) == 0:
+            self.loader.cancel()
+            return
+
+        # render pages closest to the middle of the viewport first
+        middle = self.canvas.canvasy(self.canvas.winfo_height() / 2)
+        missing.sort(key=lambda index: abs(self._offsets[index] - middle))
+
+        items = []
+        for index in missing:
+            page = self.pages[index]
+            zoom = self.page_zoom(page, scaling)
+            # preview only pages without an image
+            items.append((index, page, zoom, index not in self._shown))
+        self.loader.submit(
+            items, self.render_cache, self.render_backend, tiles, draft=self.scrolling
         )
-        labelImg.image = page
-        labelImg.id = index
 
-        # place label in frame
+        if self._poll_pending is None:
+            self._poll_pending = self.after_idle(self._poll_results)
+
+    @METRICS.timed("viewer.display")
+    def _poll_results(self) -> None:
+        """Displays pages rendered in the background in time limited batches"""
+        self._poll_pending = None
+        deadline = time.perf_counter() + self.poll_budget
+
+        while time.perf_counter() < deadline:
+            try:
+                generation, index, img, final = self.loader.results.get_nowait()
+            except queue.Empty:
+                break
+
+            # skip results of outdated requests and previews of finished pages
+            if generation != self.loader.generation or (
+                not final and index in self._rendered
+            ):
+                continue
+
+            if isinstance(index, tuple):
+                tile_index, box = index
+                self.show_tile(tile_index, box, img)
+                continue
+
+            # convert to a displayable tk-image
+            self.show_image(index, self.photo(img))
+            METRICS.count("viewer.images")
+            self._shown.add(index)
+            if final:
+                self._rendered.add(index)
+
+        if self.loader.busy:
+            self._poll_pending = self.after(self.poll_interval, self._poll_results)
+
+    def is_tiled(self, index: int) -> bool:
+        """Checks if the page at index is rendered in tiles"""
+        width, height = self._sizes[index]
+        return 0 < self.tile_threshold < width * height
+
+    def visible_tiles(self, index: int) -> List[Tuple[int, int, int, int]]:
+        """Gets the boxes of the tiles of the page at index within the viewport"""
+        x, y, width, height = self._slots[index]
+        size = self.tile_size
+
+        # one tile beyond the viewport is rendered in advance
+        left = self.canvas.canvasx(0) - x - size
+        top = self.canvas.canvasy(0) - y - size
+        right = left + self.canvas.winfo_width() + 2 * size
+        bottom = top + self.canvas.winfo_height() + 2 * size
+
+        columns = range(
+            max(int(left // size), 0), min(int(right // size) + 1, ceil(width / size))
+        )
+        rows = range(
+            max(int(top // size), 0), min(int(bottom // size) + 1, ceil(height / size))
+        )
+        return [
+            (
+                column * size,
+                row * size,
+                min((column + 1) * size, width),
+                min((row + 1) * size, height),
+            )
+            for row in rows
+            for column in columns
+        ]
+
+    def missing_tiles(
+        self, visible: range
+    ) -> List[Tuple[int, Tuple[int, int, int, int], object, float]]:
+        """Drops tiles out of view and gets the tiles to render for the pages in view
+
+        Tiles in the cache are shown at once instead of being rendered.
+        """
+        wanted = {}
+        scaling = self.scaling
+        for index in visible:
+            if self.is_tiled(index):
+                page = self.pages[index]
+                zoom = self.page_zoom(page, scaling)
+                for box in self.visible_tiles(index):
+                    wanted[(index, box)] = (page, zoom)
+
+        for key in set(self._tiles).difference(wanted):
+            self.canvas.delete(self._tiles.pop(key)[0])
+
+        cache = self.render_cache
+        missing = []
+        for (index, box), (page, zoom) in wanted.items():
+            if (index, box) in self._tiles:
+                continue
+            tile_key = cache.key(page, zoom) + (box,)
+            img = cache.get(tile_key) if tile_key in cache else None
+            if img is not None:
+                self.show_tile(index, box, img)
+            else:
+                missing.append((index, box, page, zoom))
+        return missing
+
+    def show_tile(self, index: int, box: Tuple[int, int, int, int], img) -> None:
+        """Displays a rendered tile on the page at index"""
+        if (index, box) in self._tiles:
+            return
+
+        x, y, _, _ = self._slots[index]
+        photo = self.photo(img)
+        item = self.canvas.create_image(
+            x + box[0], y + box[1], image=photo, anchor="nw", tags=("page", "tile")
+        )
+        # stay below items drawn over the pages
+        self.canvas.tag_raise(item, self.page_items[index])
+        self._tiles[(index, box)] = (item, photo)
+        METRICS.count("viewer.tiles")
+
+    def clear_tiles(self) -> None:
+        """Removes all tiles, e.g. after the pages moved or changed their size"""
+        self.canvas.delete("tile")
+        self._tiles.clear()
+
+    def photo(self, img: PageImage) -> tk.PhotoImage:
+        """Hands a rendered page to Tk, which reads the PNM data itself"""
+        METRICS.count("viewer.bytes", img.nbytes)
+        return tk.PhotoImage(master=self.canvas, data=img.data, format="ppm")
+
+    def show_image(self, index: int, image: tk.PhotoImage) -> None:
+        """Displays the image on the canvas item of the page at index"""
+        self.canvas.itemconfigure(self.page_items[index], image=image)
+        self._photos[index] = image
+
+    def highlight(self, index: int, selected: bool = True) -> None:
+        """Shows or hides the selection frame of the page at index"""
+        if selected == (index in self._painted):
+            return
+
+        color = self.selected_background if selected else self.page_background
+        self.canvas.itemconfigure(self._frames[index], fill=color)
+        if selected:
+            self._painted.add(index)
+        else:
+            self._painted.discard(index)
+
+    def clear_highlights(self) -> None:
+        """Hides the selection frame of all pages"""
+        for index in list(self._painted):
+            self.highlight(index, selected=False)
+
+    def is_selected(self, index: int) -> bool:
+        """Checks if the page at index is selected"""
+        return False
+
+    def repaint_selection(self, indices: Iterable[int]) -> None:
+        """Updates the selection frames of the pages at indices which are in view
+
+        Pages out of view are painted by render_visible once they come into view.
+        """
+        visible = self.visible_range()
+        for index in indices:
+            if index in visible:
+                self.highlight(index, self.is_selected(index))
+
+    def placeholder(self, rect, scaling) -> tk.PhotoImage:  # skipcq: PYL-W0613
+        """Gets the blank image shown until the page is rendered
+
+        The frame behind the image already marks the slot of the page, so all
+        pages share a single pixel instead of a blank as large as the page,
+        which would cost as much memory as rendering it.
+        """
+        if self._blank is None:
+            self._blank = tk.PhotoImage(master=self.canvas, width=1, height=1)
+        return self._blank
+
+    def page_zoom(self, rect, scaling) -> float:
+        """Calculates the zoom factor to render a page rect to fit in the frame"""
         if self.column == 1:
-            labelImg.pack(pady=5, padx=7)
+            zoom = fit_zoom(rect, height=self.canvas_height - self.offset_horizontal)
         else:
-            labelImg.grid(
-                row=index // self.column,
-                column=index % self.column,
-                pady=5,
-                padx=5,
+            zoom = fit_zoom(
+                rect, width=(self.canvas_width - self.offset_horizontal) / self.column
             )
 
-        return labelImg
+        return zoom * scaling
+
+    def convert_page(self, page, scaling):
+        """Covert a given page object to a displayable Image at its final size"""
+        return self.convert_pages([page], scaling)[0]
+
+    def convert_pages(self, pages, scaling) -> list:
+        """Covert the given page objects to displayable Images in one batch"""
+        with MUPDF_LOCK:
+            zooms = [self.page_zoom(page.rect, scaling) for page in pages]
+
+        # share rendered pages with the other viewers
+        return self.render_cache.render_pages(pages, zooms, self.render_backend)
+
+    def blit_page(self, page, index) -> int:
+        """Draw given Image with its selection frame at the slot of index and returns the item"""
+        x, y, width, height = self._slots[index]
+        bottom = self.title_height if self.show_titles else 0
+
+        self._frames.append(
+            self.canvas.create_rectangle(
+                x - self.border,
+                y - self.border,
+                x + width + self.border,
+                y + height + bottom + self.border,
+                fill=self.page_background,
+                outline="",
+                tags=("page", "frame"),
+            )
+        )
+        # centered, so images of a former size stay in place until rerendered
+        item = self.canvas.create_image(
+            x + width / 2, y + height / 2, image=page, tags=("page", "image")
+        )
+        self._photos.append(page)
+
+        if self.show_titles:
+            self.canvas.create_text(
+                x + width / 2,
+                y + height + bottom / 2,
+                text=self.page_title(index),
+                tags=("page", "title", f"title-{index}"),
+            )
+
+        return item
+
+    def move_page(self, index: int) -> None:
+        """Moves the items of the page at index to its current slot"""
+        x, y, width, height = self._slots[index]
+        bottom = self.title_height if self.show_titles else 0
+
+        self.canvas.coords(
+            self._frames[index],
+            x - self.border,
+            y - self.border,
+            x + width + self.border,
+            y + height + bottom + self.border,
+        )
+        self.canvas.coords(self.page_items[index], x + width / 2, y + height / 2)
+        if self.show_titles:
+            self.canvas.coords(f"title-{index}", x + width / 2, y + height + bottom / 2)
 
     def get_properties(self):
         """Function setting editor properties later used to scale the pages"""
@@ -418,10 +992,46 @@ class PageViewer(ScrollFrame):
             self.offset_vertical = self.xscrollbar.winfo_height() + 10
 
     def clear(self) -> None:
-        """Removes all widget within the frame"""
-        for widget in self.viewPort.winfo_children():
-            widget.destroy()
-        self.page_label.clear()
+        """Removes all pages from the canvas"""
+        self.canvas.delete("page")
+        self.page_items.clear()
+        self._frames.clear()
+        self._photos.clear()
+        self._sizes = []
+        self._slots.clear()
+        self.loader.cancel()
+        self._offsets.clear()
+        self._shown.clear()
+        self._rendered.clear()
+        self._painted.clear()
+        self._tiles.clear()
+
+
+# *********************** #
+#  Progress Dialog Class  #
+# *********************** #
+class ProgressDialog(tk.Toplevel):
+    """Small window showing the progress of a background task with a cancel button"""
+
+    def __init__(self, parent, text, command, *args, **kwargs):
+        super().__init__(parent, *args, **kwargs)
+        self.transient(parent)
+        self.resizable(False, False)
+
+        # == Components ==
+        self.label = tk.Label(master=self, text=text)
+        self.label.pack(padx=10, pady=5)
+        self.progressbar = ttk.Progressbar(master=self, length=300, maximum=1.0)
+        self.progressbar.pack(padx=10, pady=5)
+        self.cancelButton = tk.Button(master=self, text="Cancel", command=command)
+        self.cancelButton.pack(pady=5)
+
+        # closing the window cancels the task as well
+        self.protocol("WM_DELETE_WINDOW", command)
+
+    def set(self, value: float) -> None:
+        """Sets the progress between 0 and 1"""
+        self.progressbar["value"] = value
 
 
 if __name__ == "__main__":
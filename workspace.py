@@ -0,0 +1,81 @@
+import os
+from typing import Dict, Iterator, List, Optional
+
+from document import LoadedDocument, OpenJob
+from pagemodel import PageModel
+from rendering import MUPDF_LOCK, RenderCache
+
+__all__ = ["Workspace"]
+
+
+class Workspace:
+    """Documents kept open next to the edited one to take pages from
+
+    The sources are rendered into the same render cache as the edited document,
+    so all documents share one memory budget. A file is opened only once, no
+    matter how often it is added. Sources are opened and their pages read in the
+    background, like the edited document.
+    """
+
+    def __init__(self, cache: Optional[RenderCache] = None, open_mode: str = "file"):
+        self.cache = cache
+        self.open_mode = open_mode
+        self.sources: List[LoadedDocument] = []
+        self._pages: Dict[int, PageModel] = {}  # pages of the sources by their id
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def __iter__(self) -> Iterator[LoadedDocument]:
+        return iter(self.sources)
+
+    def __getitem__(self, index: int) -> LoadedDocument:
+        return self.sources[index]
+
+    def find(self, path: str) -> Optional[LoadedDocument]:
+        """Gets the source opened from the file at path"""
+        for source in self.sources:
+            try:
+                if os.path.samefile(source.path, path):
+                    return source
+            except OSError:
+                continue
+        return None
+
+    def open(self, path: str) -> OpenJob:
+        """Starts opening the document at path in the background to add it as source"""
+        return OpenJob(path, self.open_mode, lock=MUPDF_LOCK).start()
+
+    def add(self, job: OpenJob) -> LoadedDocument:
+        """Adds the document of a finished job as source unless its file is open already"""
+        loaded, pages = job.loaded, job.pages
+        if not job.succeeded or loaded is None or pages is None:
+            raise ValueError(job.error or "The document was not opened")
+
+        source = self.find(loaded.path)
+        if source is not None:
+            with MUPDF_LOCK:
+                loaded.close()
+            return source
+
+        self.sources.append(loaded)
+        self._pages[id(loaded)] = pages
+        return loaded
+
+    def pages(self, source: LoadedDocument) -> PageModel:
+        """Gets the pages of a source, read when it was opened"""
+        return self._pages[id(source)]
+
+    def remove(self, source: LoadedDocument) -> None:
+        """Closes a source after dropping its pages from the render cache"""
+        self.sources.remove(source)
+        del self._pages[id(source)]
+        if self.cache is not None:
+            self.cache.drop_document(source.document)
+        with MUPDF_LOCK:
+            source.close()
+
+    def close(self) -> None:
+        """Closes all sources"""
+        for source in list(self.sources):
+            self.remove(source)